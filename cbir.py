@@ -1,13 +1,20 @@
-import cv2
-import numpy as np
-from database import chroma
-from engine import processing_engine as engine
 import os
+import sys
+import json
+import pickle
+import queue
+import hashlib
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-import shutil
 import argparse
 from datetime import datetime
-from evaluation_system import CBIREvaluationSystem
+
+# cv2, chromadb e o engine custam ~1-2 s de import em cold start; eles são
+# importados dentro das funções que realmente os usam para que --help e
+# --clear-db não paguem esse custo.
 
 def parse_arguments():
     """Parse command line arguments"""
@@ -24,102 +31,389 @@ def parse_arguments():
                       help='Caminho para o diretório de referência (usado com --process-only)')
     parser.add_argument('--generate-report', action='store_true',
                       help='Gera relatório visual da avaliação')
+    parser.add_argument('--hnsw-ef', type=int, default=None,
+                      help='Sobrescreve o search_ef do índice HNSW (recall vs. latência)')
+    parser.add_argument('--workers', type=float, default=0.5,
+                      help='Fração dos núcleos usada na extração de características (0.5 = metade)')
+    parser.add_argument('--fast-query', action='store_true',
+                      help='Consulta pela matriz exportada via memmap em vez do índice do chroma')
+    parser.add_argument('--export-memmap', action='store_true',
+                      help='Exporta os embeddings do banco para a matriz usada por --fast-query')
     return parser.parse_args()
 
 
-def process_dataset(dataset_path):
-    """Processa todas as imagens do dataset"""
+# Extensões de imagem aceitas; tupla única para um só endswith em C
+_VALID_EXTS = ('.jpg', '.jpeg', '.png')
+
+# Tamanho do lote de inserções no banco de dados
+BATCH_SIZE = 200
+
+# Quantidade de imagens decodificadas mantidas prontas à frente da extração
+PREFETCH_DEPTH = 32
+
+# Rótulos de exibição por categoria; lookup único em vez de ternários no loop
+CATEGORY_LABELS = {
+    "leaf_healthy": "Folha Saudável",
+    "leaf_with_disease": "Folha com Doença",
+}
+
+# Manifesto {caminho: mtime} da última ingestão; permite pular arquivos
+# inalterados em reexecuções de --process-only sem reextrair nada
+_MANIFEST_PATH = os.path.join(".cache", "manifest.json")
+
+def _load_manifest():
+    """Carrega o manifesto de mtimes da última ingestão"""
+    try:
+        with open(_MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_manifest(manifest):
+    """Grava o manifesto de mtimes após uma ingestão"""
+    os.makedirs(os.path.dirname(_MANIFEST_PATH), exist_ok=True)
+    with open(_MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f)
+
+def _prefetch_decoded(paths, depth=PREFETCH_DEPTH):
+    """Decodifica imagens em threads, mantendo uma fila de quadros prontos.
+
+    A decodificação JPEG libera o GIL, então threads conseguem manter a
+    extração de características sempre alimentada com o próximo quadro,
+    sobrepondo I/O de disco com o processamento da imagem anterior.
+    """
+    import cv2
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = deque()
+        path_iter = iter(paths)
+        for path in itertools.islice(path_iter, depth):
+            futures.append((path, pool.submit(cv2.imread, path, cv2.IMREAD_COLOR)))
+        for path in path_iter:
+            ready_path, future = futures.popleft()
+            futures.append((path, pool.submit(cv2.imread, path, cv2.IMREAD_COLOR)))
+            yield ready_path, future.result()
+        while futures:
+            ready_path, future = futures.popleft()
+            yield ready_path, future.result()
+
+def _image_id(image_path):
+    """Gera um id determinístico para uma imagem a partir do caminho"""
+    return hashlib.md5(image_path.encode()).hexdigest()
+
+def _scan_category(category_entry):
+    """Lista as imagens de um diretório de categoria"""
+    paths = []
+    with os.scandir(category_entry.path) as files:
+        for file_entry in files:
+            if file_entry.is_file() and \
+                    file_entry.name.lower().endswith(_VALID_EXTS):
+                paths.append((category_entry.name, file_entry.path))
+    return paths
+
+def walk_dataset(root):
+    """Percorre o dataset em uma única passada, gerando (categoria, caminho).
+
+    Usa os.scandir para evitar um segundo stat() por arquivo, o que pesa
+    em datasets grandes ou montados em sistemas de arquivos remotos.
+    Os diretórios de categoria são listados em paralelo por threads, já
+    que cada listagem é independente e limitada por I/O.
+    """
+    with os.scandir(root) as entries:
+        categories = [entry for entry in entries
+                      if entry.is_dir(follow_symlinks=False)]
+
+    if not categories:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(8, len(categories))) as pool:
+        futures = [pool.submit(_scan_category, category)
+                   for category in categories]
+        for future in as_completed(futures):
+            yield from future.result()
+
+def process_dataset(dataset_path, workers=0.5):
+    """Processa todas as imagens do dataset.
+
+    workers é a fração dos núcleos dedicada à extração de características;
+    o padrão de 0.5 deixa folga para as escritas no banco e para o sistema.
+    """
+    from database import chroma
+    from engine import processing_engine as engine
+
+    # tqdm é opcional: com ele instalado o progresso vira uma barra única
+    # atualizada a cada ~0.1 s; sem ele, fica a linha por lote de sempre
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        tqdm = None
+
     dataset_dir = Path(dataset_path)
-    
+
     # Verificar se o diretório existe
     if not dataset_dir.exists():
         print(f"\n❌ ERRO: O diretório de referência '{dataset_path}' não foi encontrado.")
         return
-    
-    # Verificar se há imagens no diretório dataset
-    total_images = sum(1 for _ in dataset_dir.rglob("*") 
-                      if _.suffix.lower() in ['.jpg', '.jpeg', '.png'])
-    
+
+    # Coletar os caminhos e contar as imagens em uma única passada
+    all_paths = list(walk_dataset(dataset_dir))
+    total_images = len(all_paths)
+
     if total_images == 0:
         print("\nAVISO: Nenhuma imagem encontrada no conjunto de referência.")
         print(os.path.abspath("image/dataset"))
         return
-    
+
     print(f"\nEncontradas {total_images} imagens para processar no conjunto de referência.")
-    
+
+    # Pular imagens já inseridas em execuções anteriores: uma única leitura
+    # dos ids existentes evita reextrair e reinserir o dataset inteiro
+    existing_ids = chroma.get_all_ids()
+    if existing_ids:
+        remaining = [(category, path) for category, path in all_paths
+                     if _image_id(path) not in existing_ids]
+        skipped = len(all_paths) - len(remaining)
+        if skipped:
+            print(f"{skipped} imagens já estavam no banco e serão ignoradas.")
+        all_paths = remaining
+        if not all_paths:
+            print("Nenhuma imagem nova para processar.")
+            return
+
+    # Filtrar pelos mtimes do manifesto: arquivos inalterados desde a última
+    # ingestão são pulados sem nenhuma leitura do banco ou extração
+    manifest = _load_manifest()
+    current_mtimes = {path: os.stat(path).st_mtime for _, path in all_paths}
+    new_manifest = dict(manifest)
+    if manifest:
+        remaining = [(category, path) for category, path in all_paths
+                     if manifest.get(path) != current_mtimes[path]]
+        unchanged = len(all_paths) - len(remaining)
+        if unchanged:
+            print(f"{unchanged} imagens inalteradas desde a última ingestão serão ignoradas.")
+        all_paths = remaining
+        if not all_paths:
+            print("Nenhuma imagem nova para processar.")
+            return
+
     # Dicionário para armazenar estatísticas por categoria
-    stats = {}
-    
-    # Processar cada categoria separadamente
-    for category_dir in dataset_dir.iterdir():
-        if not category_dir.is_dir():
-            continue
-            
-        category_name = category_dir.name
-        stats[category_name] = {"processed": 0, "errors": 0}
-        
-        print(f"\nProcessando categoria: {category_name}")
-        
-        # Processar imagens da categoria
-        for img_path in category_dir.glob('*'):
-            if img_path.suffix.lower() in ['.jpg', '.jpeg', '.png']:
-                try:
-                    result = engine.process_image(str(img_path), save_to_db=True)
-                    if "error" in result:
-                        print(f"Erro ao processar {img_path.name}: {result['error']}")
-                        stats[category_name]["errors"] += 1
-                    else:
-                        stats[category_name]["processed"] += 1
-                        if stats[category_name]["processed"] % 10 == 0:
-                            print(f"Processadas {stats[category_name]['processed']} imagens em {category_name}")
-                except Exception as e:
-                    print(f"Erro ao processar {img_path.name}: {str(e)}")
-                    stats[category_name]["errors"] += 1
-    
-    # Exibir resumo do processamento
-    print("\nResumo do processamento por categoria:")
-    print("=" * 50)
-    
+    stats = {category: {"processed": 0, "errors": 0}
+             for category, _ in all_paths}
+
+    # Buffers para inserção em lote no banco de dados
+    pending_ids = []
+    pending_embeddings = []
+    pending_metadatas = []
+    pending_categories = []
+    pending_paths = []
+    total_flushed = 0
+
+    # Fila limitada + thread de escrita: a extração (CPU) segue adiante
+    # enquanto o lote anterior é gravado no banco (I/O). O maxsize dá
+    # contrapressão se o disco não acompanhar o ritmo da extração.
+    write_queue = queue.Queue(maxsize=8)
+
+    def _db_writer():
+        """Drena a fila de lotes, gravando cada um em uma chamada ao banco"""
+        nonlocal total_flushed
+        while True:
+            batch = write_queue.get()
+            if batch is None:
+                break
+            batch_ids, batch_embeddings, batch_metadatas, batch_categories, batch_paths = batch
+            try:
+                ok = chroma.add_embeddings_batch(batch_ids, batch_embeddings, batch_metadatas)
+            except Exception as e:
+                print(f"Erro ao inserir lote no banco de dados: {str(e)}")
+                ok = False
+            if ok:
+                # Só marcar no manifesto o que de fato chegou ao banco;
+                # lotes que falham serão tentados de novo na próxima execução
+                for path in batch_paths:
+                    new_manifest[path] = current_mtimes[path]
+            else:
+                for category in batch_categories:
+                    stats[category]["errors"] += 1
+                    stats[category]["processed"] -= 1
+            total_flushed += len(batch_ids)
+            # Único ponto de progresso do ingest: uma linha por lote, com flush
+            # explícito para o usuário ver o avanço mesmo com stdout em pipe
+            # (suprimida quando a barra do tqdm está ativa)
+            if tqdm is None:
+                print(f"Inseridas {total_flushed}/{total_images} imagens no banco", flush=True)
+
+    writer_thread = threading.Thread(target=_db_writer, daemon=True)
+    writer_thread.start()
+
+    # Um timestamp por lote: formatar datetime.now() por imagem custa uma
+    # alocação e formatação de microssegundos que não agrega nada a um
+    # dataset de referência
+    batch_ts = datetime.now().isoformat(timespec='seconds')
+
+    def flush_pending():
+        """Enfileira o lote acumulado para a thread de escrita"""
+        nonlocal batch_ts
+        batch_ts = datetime.now().isoformat(timespec='seconds')
+        if not pending_ids:
+            return
+        write_queue.put((list(pending_ids), list(pending_embeddings),
+                         list(pending_metadatas), list(pending_categories),
+                         list(pending_paths)))
+        pending_ids.clear()
+        pending_embeddings.clear()
+        pending_metadatas.clear()
+        pending_categories.clear()
+        pending_paths.clear()
+
+    def handle_result(category_name, img_path, result):
+        """Acumula o resultado de uma extração no lote pendente"""
+        # Uma única resolução do dict de stats da categoria por imagem,
+        # em vez de refazer o hash duplo stats[cat][chave] a cada acesso
+        cat_stats = stats[category_name]
+        if "error" in result:
+            print(f"Erro ao processar {os.path.basename(img_path)}: {result['error']}")
+            cat_stats["errors"] += 1
+            return
+
+        pending_ids.append(_image_id(img_path))
+        pending_embeddings.append(result["features"])
+        pending_metadatas.append({
+            "path": img_path,
+            "type": "leaf_disease",
+            "processing_date": batch_ts,
+            "category": category_name
+        })
+        pending_categories.append(category_name)
+        pending_paths.append(img_path)
+        cat_stats["processed"] += 1
+        if len(pending_ids) >= BATCH_SIZE:
+            flush_pending()
+
+    # Extrair características em paralelo (a extração é limitada por CPU e
+    # independente por imagem); as escritas no banco ficam no processo principal
+    def progress(pairs):
+        """Envolve o iterador com a barra do tqdm quando disponível"""
+        if tqdm is None:
+            return pairs
+        return tqdm(pairs, total=len(all_paths), unit='img', smoothing=0.05)
+
+    max_workers = max(1, int((os.cpu_count() or 1) * workers))
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(engine.process_image_features_only,
+                                   [path for _, path in all_paths],
+                                   chunksize=16)
+            for (category_name, img_path), result in progress(zip(all_paths, results)):
+                handle_result(category_name, img_path, result)
+    else:
+        # Sem múltiplos núcleos: ainda assim sobrepor decodificação (threads)
+        # com a extração de características no processo principal
+        categories_by_path = iter(all_paths)
+        for (category_name, img_path), (_, image) in progress(zip(
+                categories_by_path, _prefetch_decoded([p for _, p in all_paths]))):
+            handle_result(category_name, img_path,
+                          engine.extract_features_from_array(image))
+
+    # Inserir o restante do lote e esperar a thread de escrita terminar
+    flush_pending()
+    write_queue.put(None)
+    writer_thread.join()
+
+    # Persistir o manifesto; arquivos com erro ficam de fora e serão
+    # tentados novamente na próxima execução
+    _save_manifest(new_manifest)
+
+    # Exibir resumo do processamento em uma única escrita no stdout
+    lines = ["", "Resumo do processamento por categoria:", "=" * 50]
+
     total_processed = 0
     total_errors = 0
-    
+
     for category, counts in stats.items():
         processed = counts["processed"]
         errors = counts["errors"]
         total = processed + errors
         success_rate = (processed / total * 100) if total > 0 else 0
-        
-        print(f"\n{category}:")
-        print(f"- Processadas com sucesso: {processed}")
-        print(f"- Erros: {errors}")
-        print(f"- Taxa de sucesso: {success_rate:.1f}%")
-        
+
+        lines.append(f"\n{category}:")
+        lines.append(f"- Processadas com sucesso: {processed}")
+        lines.append(f"- Erros: {errors}")
+        lines.append(f"- Taxa de sucesso: {success_rate:.1f}%")
+
         total_processed += processed
         total_errors += errors
-    
-    print("\nEstatísticas gerais:")
-    print("=" * 50)
-    print(f"Total de imagens processadas: {total_processed}")
-    print(f"Total de erros: {total_errors}")
+
+    lines.extend(["", "Estatísticas gerais:", "=" * 50])
+    lines.append(f"Total de imagens processadas: {total_processed}")
+    lines.append(f"Total de erros: {total_errors}")
     total = total_processed + total_errors
     success_rate = (total_processed / total * 100) if total > 0 else 0
-    print(f"Taxa de sucesso geral: {success_rate:.1f}%")
+    lines.append(f"Taxa de sucesso geral: {success_rate:.1f}%")
+    sys.stdout.write("\n".join(lines) + "\n")
+
+# Cache de consultas indexado pelo hash do conteúdo do arquivo; evita
+# reextrair características e repetir a busca para uploads idênticos.
+# O cache é persistido em disco para sobreviver entre execuções do CLI,
+# onde cada consulta é um processo novo.
+_query_cache = None
+_QUERY_CACHE_MAX = 256
+_QUERY_CACHE_PATH = os.path.join("database", "query_cache.pkl")
 
-def process_query_image(image_path):
-    """Processa uma imagem de consulta e retorna os resultados"""
+def _load_query_cache():
+    """Carrega o cache de consultas persistido, se existir"""
+    global _query_cache
+    if _query_cache is None:
+        try:
+            with open(_QUERY_CACHE_PATH, "rb") as f:
+                _query_cache = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            _query_cache = {}
+    return _query_cache
+
+def _save_query_cache():
+    """Persiste o cache de consultas em disco"""
     try:
-        # Processar imagem original para consulta
-        query_result = engine.process_image(image_path, save_to_db=False, visualize=False)
-        
-        if "error" in query_result:
-            return {"error": query_result["error"]}
-        
-        # Processar imagem com visualização (apenas para gerar a imagem de análise)
+        with open(_QUERY_CACHE_PATH, "wb") as f:
+            pickle.dump(_query_cache, f)
+    except OSError as e:
+        print(f"Aviso: não foi possível salvar o cache de consultas: {str(e)}")
+
+def _query_cache_key(image_path):
+    """Gera a chave de cache para uma imagem de consulta"""
+    from database import chroma
+
+    with open(image_path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    # Incluir o total de imagens do banco invalida o cache automaticamente
+    # quando novas imagens de referência são inseridas
+    return digest, chroma.get_database_stats()["total_images"]
+
+def process_query_image(image_path, fast_query=False):
+    """Processa uma imagem de consulta e retorna os resultados.
+
+    Com fast_query=True a busca usa a matriz de embeddings exportada por
+    --export-memmap (um produto matriz-vetor via BLAS), evitando o custo
+    de abrir o chroma a cada processo.
+    """
+    from database import chroma
+    from engine import processing_engine as engine
+
+    try:
+        cache_key = _query_cache_key(image_path)
+        cached = _load_query_cache().get(cache_key)
+        if cached is not None:
+            return cached
+    except Exception:
+        cache_key = None
+
+    try:
+        # Processar a imagem uma única vez: o mesmo resultado traz as
+        # características para a consulta e a imagem de análise
         result = engine.process_image(image_path, save_to_db=False, visualize=True)
-        
+
         if "error" in result:
             return {"error": result["error"]}
-        
+
         # Adicionar metadados da imagem de consulta
         query_metadata = {
             "path": image_path,
@@ -129,7 +423,10 @@ def process_query_image(image_path):
         }
         
         # Consultar imagens similares usando as características da imagem original
-        query_results = chroma.query_embedding(query_result["features"], metadata=query_metadata)
+        if fast_query:
+            query_results = chroma.query_embedding_memmap(result["features"], metadata=query_metadata)
+        else:
+            query_results = chroma.query_embedding(result["features"], metadata=query_metadata)
         
         if not query_results:
             return {"error": "Erro ao consultar banco de dados"}
@@ -143,10 +440,11 @@ def process_query_image(image_path):
         # Adicionar caminho da visualização ao resultado
         analysis["visualization_path"] = result.get("visualization_path")
         
-        # Atualizar a categoria da imagem de análise para corresponder ao resultado
+        # Registrar a imagem de análise reaproveitando as características já
+        # extraídas da consulta: nada de redecodificar o PNG recém-gerado
+        # nem refazer a extração só para inserir os metadados
         analysis_path = result.get("visualization_path")
         if analysis_path:
-            # Processar a imagem de análise novamente com a categoria correta
             analysis_metadata = {
                 "path": analysis_path,
                 "type": "leaf_disease_analysis",
@@ -154,17 +452,32 @@ def process_query_image(image_path):
                 "original_image": image_path,
                 "category": analysis["identified_category"]  # Usar a categoria identificada (leaf_healthy ou leaf_with_disease)
             }
-            engine.process_image(analysis_path, save_to_db=True, visualize=False, metadata=analysis_metadata)
-        
+            # Escrita fire-and-forget: o usuário não precisa esperar a
+            # inserção da imagem de análise para ver o resultado da consulta
+            threading.Thread(
+                target=chroma.add_embedding,
+                args=(_image_id(analysis_path), result["features"]),
+                kwargs={"metadata": analysis_metadata},
+            ).start()
+
+        if cache_key is not None:
+            cache = _load_query_cache()
+            if len(cache) >= _QUERY_CACHE_MAX:
+                cache.pop(next(iter(cache)))
+            cache[cache_key] = analysis
+            _save_query_cache()
+
         return analysis
-        
+
     except Exception as e:
         return {"error": str(e)}
 
 def evaluate_system():
     """Executa avaliação completa do sistema"""
     print("\n=== AVALIAÇÃO DO SISTEMA CBIR ===")
-    
+
+    from evaluation_system import CBIREvaluationSystem
+
     # Criar sistema de avaliação
     evaluator = CBIREvaluationSystem()
     
@@ -229,15 +542,26 @@ def main():
     """Função principal"""
     global args
     args = parse_arguments()
-    
+
+    from database import chroma
+
+    if args.hnsw_ef is not None:
+        chroma.set_search_ef(args.hnsw_ef)
+
     if args.clear_db:
         print("Limpando banco de dados...")
         chroma.clear_database()
         print("Banco de dados limpo.")
 
+    if args.export_memmap:
+        print("Exportando embeddings para a matriz de consulta rápida...")
+        if chroma.export_to_memmap():
+            print("Exportação concluída.")
+        return
+
     if args.process_only:
         print(f"Iniciando processamento do conjunto de referência em: {args.train_dir}")
-        process_dataset(args.train_dir)
+        process_dataset(args.train_dir, workers=args.workers)
         return
 
     if args.evaluate:
@@ -260,113 +584,110 @@ def main():
     
     print("\n=== SISTEMA DE ANÁLISE DE DOENÇAS EM FOLHAS ===")
     print("Analisando imagem...")
-    result = process_query_image(query_path)
+    result = process_query_image(query_path, fast_query=args.fast_query)
     
     if isinstance(result, dict) and "error" in result:
         print(f"\nErro ao processar imagem: {result['error']}")
         return
     
     # Criar sistema de avaliação para previsão de revogação
+    from evaluation_system import CBIREvaluationSystem
+
     evaluator = CBIREvaluationSystem()
     revocation_prediction = evaluator.predict_revocation_risk(result)
     
-    # Exibir resultados
-    print("\n" + "="*50)
-    print("RESULTADOS DA ANÁLISE".center(50))
-    print("="*50)
-    
+    # Montar o relatório em memória e escrever no stdout de uma só vez,
+    # evitando dezenas de flushes individuais em terminal com line buffer
+    lines = ["", "="*50, "RESULTADOS DA ANÁLISE".center(50), "="*50]
+
     if "identified_category" in result:
         category = result["identified_category"]
         confidence = result["confidence"]
-        
+
         # Exibir diagnóstico
-        print("\n📋 DIAGNÓSTICO")
-        print("-"*50)
-        print(f"Categoria identificada: {category}")
-        print(f"Nível de confiança: {confidence:.1f}%")
-        
+        lines.extend(["", "📋 DIAGNÓSTICO", "-"*50])
+        lines.append(f"Categoria identificada: {category}")
+        lines.append(f"Nível de confiança: {confidence:.1f}%")
+
         # Exibir previsão de revogação
-        print("\n⚠️ PREVISÃO DE REVOGAÇÃO")
-        print("-"*50)
+        lines.extend(["", "⚠️ PREVISÃO DE REVOGAÇÃO", "-"*50])
         risk_level = revocation_prediction["revocation_risk"]
         risk_score = revocation_prediction["risk_score"]
         risk_factors = revocation_prediction["risk_factors"]
-        
-        print(f"Nível de risco: {risk_level}")
-        print(f"Score de risco: {risk_score:.3f}")
-        
+
+        lines.append(f"Nível de risco: {risk_level}")
+        lines.append(f"Score de risco: {risk_score:.3f}")
+
         if risk_factors:
-            print("Fatores de risco identificados:")
+            lines.append("Fatores de risco identificados:")
             for factor in risk_factors:
-                print(f"• {factor}")
+                lines.append(f"• {factor}")
         else:
-            print("Nenhum fator de risco significativo identificado")
-        
+            lines.append("Nenhum fator de risco significativo identificado")
+
         # Exibir distribuição de categorias
-        print("\n📊 DISTRIBUIÇÃO DE CATEGORIAS")
-        print("-"*50)
+        lines.extend(["", "📊 DISTRIBUIÇÃO DE CATEGORIAS", "-"*50])
         for cat, perc in result["category_distribution"].items():
-            cat_name = "Folha Saudável" if cat == "leaf_healthy" else "Folha com Doença"
-            print(f"• {cat_name}: {perc:.1f}%")
-        
+            cat_name = CATEGORY_LABELS.get(cat, cat)
+            lines.append(f"• {cat_name}: {perc:.1f}%")
+
         # Exibir imagens similares
-        print("\n🔍 IMAGENS MAIS SIMILARES ENCONTRADAS")
-        print("-"*50)
-        # Ordenar imagens por similaridade em ordem decrescente
-        sorted_images = sorted(result["similar_images"], key=lambda x: x["similarity"], reverse=True)
-        for i, img in enumerate(sorted_images, 1):
-            category = "Folha Saudável" if img["category"] == "leaf_healthy" else "Folha com Doença"
+        lines.extend(["", "🔍 IMAGENS MAIS SIMILARES ENCONTRADAS", "-"*50])
+        # analyze_query_results já devolve as imagens ordenadas por
+        # similaridade decrescente; não há por que reordenar aqui
+        for i, img in enumerate(result["similar_images"], 1):
+            img_category = CATEGORY_LABELS.get(img["category"], img["category"])
             similarity = img["similarity"]
-            print(f"\nImagem #{i}:")
-            print(f"• Categoria: {category}")
-            print(f"• Similaridade: {similarity:.1f}%")
-            print(f"• Caminho: {img['metadata']['path']}")
-            
+            lines.append(f"\nImagem #{i}:")
+            lines.append(f"• Categoria: {img_category}")
+            lines.append(f"• Similaridade: {similarity:.1f}%")
+            lines.append(f"• Caminho: {img['metadata']['path']}")
+
         # Adicionar recomendações baseadas na confiança e risco de revogação
-        print("\n💡 RECOMENDAÇÕES")
-        print("-"*50)
-        
+        lines.extend(["", "💡 RECOMENDAÇÕES", "-"*50])
+
         # Recomendações baseadas na confiança
         if confidence >= 80:
-            print("✅ Diagnóstico altamente confiável")
+            lines.append("✅ Diagnóstico altamente confiável")
         elif confidence >= 50:
-            print("⚠️ Diagnóstico provável, mas necessita confirmação")
+            lines.append("⚠️ Diagnóstico provável, mas necessita confirmação")
         else:
-            print("❓ Diagnóstico incerto")
-        
+            lines.append("❓ Diagnóstico incerto")
+
         # Recomendações baseadas no risco de revogação
         if risk_level == "ALTO":
-            print("🚨 ALTO RISCO DE REVOGAÇÃO - Recomendações especiais:")
-            print("1. Consulte um especialista para confirmação")
-            print("2. Tire novas fotos com melhor iluminação e ângulos")
-            print("3. Considere usar imagens de diferentes partes da planta")
-            print("4. Verifique se a imagem está bem focada e sem sombras")
+            lines.append("🚨 ALTO RISCO DE REVOGAÇÃO - Recomendações especiais:")
+            lines.append("1. Consulte um especialista para confirmação")
+            lines.append("2. Tire novas fotos com melhor iluminação e ângulos")
+            lines.append("3. Considere usar imagens de diferentes partes da planta")
+            lines.append("4. Verifique se a imagem está bem focada e sem sombras")
         elif risk_level == "MÉDIO":
-            print("⚠️ RISCO MÉDIO DE REVOGAÇÃO:")
-            print("1. Faça uma inspeção visual detalhada da planta")
-            print("2. Tire mais fotos de diferentes ângulos")
-            print("3. Consulte um especialista para confirmação")
+            lines.append("⚠️ RISCO MÉDIO DE REVOGAÇÃO:")
+            lines.append("1. Faça uma inspeção visual detalhada da planta")
+            lines.append("2. Tire mais fotos de diferentes ângulos")
+            lines.append("3. Consulte um especialista para confirmação")
         else:
-            print("✅ BAIXO RISCO DE REVOGAÇÃO")
-            print("O diagnóstico tem alta confiabilidade")
-        
+            lines.append("✅ BAIXO RISCO DE REVOGAÇÃO")
+            lines.append("O diagnóstico tem alta confiabilidade")
+
         # Ações recomendadas baseadas na categoria
-        print("\nAções recomendadas:")
+        lines.append("\nAções recomendadas:")
         if "healthy" in category.lower():
-            print("1. Continue monitorando a planta regularmente")
-            print("2. Mantenha as práticas de cuidado atuais")
-            print("3. Tire fotos periódicas para acompanhamento")
+            lines.append("1. Continue monitorando a planta regularmente")
+            lines.append("2. Mantenha as práticas de cuidado atuais")
+            lines.append("3. Tire fotos periódicas para acompanhamento")
         else:
-            print("1. Consulte um especialista para confirmar o diagnóstico")
-            print("2. Pesquise tratamentos específicos para", category)
-            print("3. Isole as plantas afetadas para evitar propagação")
-            print("4. Monitore outras plantas próximas")
+            lines.append("1. Consulte um especialista para confirmar o diagnóstico")
+            lines.append(f"2. Pesquise tratamentos específicos para {category}")
+            lines.append("3. Isole as plantas afetadas para evitar propagação")
+            lines.append("4. Monitore outras plantas próximas")
     else:
-        print("Não foi possível identificar a doença.")
-    
-    print("\n" + "="*50)
-    print(f"Imagem de análise salva em: {result.get('visualization_path', 'N/A')}")
-    print("="*50 + "\n")
+        lines.append("Não foi possível identificar a doença.")
+
+    lines.extend(["", "="*50])
+    lines.append(f"Imagem de análise salva em: {result.get('visualization_path', 'N/A')}")
+    lines.append("="*50 + "\n")
+    sys.stdout.write("\n".join(lines) + "\n")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
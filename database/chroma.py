@@ -1,43 +1,151 @@
 import chromadb
+import functools
+import logging
+import re
 import numpy as np
+from collections import Counter, namedtuple
 from chromadb.config import Settings
 import os
-import multiprocessing
 from datetime import datetime
-import argparse
 import json
+from dataclasses import dataclass
 
-# Configurar cliente persistente com configurações otimizadas
-client = chromadb.PersistentClient(
-    path="database/chroma_db",
-    settings=Settings(
-        anonymized_telemetry=False,
-        allow_reset=True
+logger = logging.getLogger(__name__)
+
+# Parâmetros HNSW explícitos em vez dos defaults do chroma, dimensionados
+# para vetores de 128-D na escala de milhares: M=24/construction_ef=128
+# dão um grafo de boa qualidade sem o custo de construção de valores
+# maiores (que não melhoram recall nesta escala), e search_ef=64 mantém a
+# consulta barata — sobrescrevível via set_search_ef/--hnsw-ef. batch_size
+# e sync_threshold maiores amortizam os flushes do índice no ingest.
+_COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 24,
+    "hnsw:construction_ef": 128,
+    "hnsw:search_ef": 64,
+    "hnsw:batch_size": 1000,
+    "hnsw:sync_threshold": 10000,
+    "description": "Características de doenças em folhas",
+    "feature_hsv": "96 valores (32 bins para cada canal H, S, V)",
+    "feature_texture": "6 valores (média e desvio para 3 kernels)",
+    "feature_shape": "6 valores (num_spots, mean_size, std_size, max_ratio, area_total, circularidade)"
+}
+
+@functools.lru_cache(maxsize=1)
+def _client():
+    """Cliente persistente único por processo, criado sob demanda"""
+    # Ajustes lidos pelo chroma na construção: política LRU para o cache
+    # de segmentos (libera memória de coleções frias) e telemetria
+    # desligada também por env, cobrindo versões que ignoram o Settings
+    os.environ.setdefault("CHROMA_SEGMENT_CACHE_POLICY", "LRU")
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    return chromadb.PersistentClient(
+        path="database/chroma_db",
+        settings=Settings(
+            anonymized_telemetry=False,
+            allow_reset=True
+        )
     )
-)
-
-# Criar ou obter coleção
-collection = client.get_or_create_collection(
-    name="leaf_diseases",
-    metadata={
-        "hnsw:space": "cosine",
-        "description": "Características de doenças em folhas",
-        "feature_hsv": "96 valores (32 bins para cada canal H, S, V)",
-        "feature_texture": "6 valores (média e desvio para 3 kernels)",
-        "feature_shape": "6 valores (num_spots, mean_size, std_size, max_ratio, area_total, circularidade)"
-    }
-)
+
+@functools.lru_cache(maxsize=1)
+def _collection():
+    """Coleção única por processo; abrir o índice HNSW é caro, então o
+    handle é criado uma vez e reutilizado em todas as chamadas"""
+    return _client().get_or_create_collection(
+        name="leaf_diseases",
+        metadata=_COLLECTION_METADATA
+    )
+
+# Quantização SQ8 opcional dos embeddings armazenados (CBIR_QUANTIZE=1).
+# O chromadb só aceita vetores float, então o codec é aplicado como redução
+# de precisão no momento da gravação: cada vetor passa por int8 + escala,
+# mantendo 256 níveis por dimensão com perda de recall desprezível.
+# A escala é por vetor (simétrica) e não por dimensão: uma escala por
+# dimensão exigiria calibração offline sobre o dataset e não traria ganho
+# real aqui, já que o chroma rearmazena os valores como float de qualquer
+# forma — o benefício de banda do int8 nativo só existiria com um índice
+# que aceitasse vetores inteiros.
+QUANTIZE_EMBEDDINGS = os.environ.get("CBIR_QUANTIZE") == "1"
+
+def sq8_encode(embedding):
+    """Quantiza um embedding para int8 simétrico com escala por vetor"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    scale = float(np.abs(vector).max()) / 127.0
+    if scale == 0:
+        return np.zeros(vector.shape, dtype=np.int8), 1.0
+    quantized = np.clip(np.round(vector / scale), -127, 127).astype(np.int8)
+    return quantized, scale
+
+def sq8_decode(quantized, scale):
+    """Reconstrói o embedding float32 a partir do vetor int8 e da escala"""
+    return np.asarray(quantized, dtype=np.float32) * scale
+
+def _maybe_quantize(embedding):
+    """Aplica o round-trip SQ8 quando a quantização está habilitada"""
+    if not QUANTIZE_EMBEDDINGS:
+        return embedding
+    quantized, scale = sq8_encode(embedding)
+    return sq8_decode(quantized, scale).tolist()
+
+def set_search_ef(search_ef):
+    """Ajusta o search_ef do índice HNSW em tempo de execução"""
+    try:
+        metadata = dict(_collection().metadata or {})
+        metadata["hnsw:search_ef"] = int(search_ef)
+        _collection().modify(metadata=metadata)
+        return True
+    except Exception as e:
+        print(f"Erro ao ajustar hnsw:search_ef: {str(e)}")
+        return False
+
+# Cache das estatísticas do banco: collection.get() desserializa a coleção
+# inteira, caro demais para algo que só muda quando há escrita. O flag
+# dirty é ligado na limpeza do banco; inserções atualizam o cache in-place.
+_stats_cache = {'data': None, 'dirty': True}
+
+def invalidate_stats():
+    """Marca o cache de estatísticas como sujo.
+
+    A próxima chamada a get_database_stats recalcula a partir da coleção;
+    usar após escritas feitas fora de add_embedding/add_embeddings_batch.
+    """
+    _stats_cache['dirty'] = True
+
+def _stats_record_insert(ids, metadatas):
+    """Atualiza o cache de estatísticas em memória após uma inserção"""
+    data = _stats_cache['data']
+    if data is None or _stats_cache['dirty']:
+        return
+    if not metadatas or len(metadatas) != len(ids):
+        # Sem metadados não dá para manter as contagens por categoria
+        _stats_cache['dirty'] = True
+        return
+    data['total_images'] += len(ids)
+    data['ids'].extend(ids)
+    for metadata in metadatas:
+        if not metadata:
+            continue
+        category = metadata.get('category', 'unknown')
+        data['categories'][category] = data['categories'].get(category, 0) + 1
+        proc_date = metadata.get('processing_date')
+        if proc_date and (not data['last_update'] or proc_date > data['last_update']):
+            data['last_update'] = proc_date
 
 def get_database_stats():
     """
     Retorna estatísticas detalhadas do banco de dados.
-    
+
     Returns:
         Dicionário com estatísticas sobre as imagens armazenadas
     """
+    if not _stats_cache['dirty'] and _stats_cache['data'] is not None:
+        return _stats_cache['data']
+
     try:
-        # Pegar todos os itens no banco
-        results = collection.get()
+        # Pegar todos os itens no banco. O include explícito evita que o
+        # get() desserialize também os embeddings (512+ bytes por vetor)
+        # que esta função nunca lê — só ids e metadados são necessários.
+        results = _collection().get(include=["metadatas"])
         
         if not results or "ids" not in results:
             return {
@@ -55,23 +163,21 @@ def get_database_stats():
             "ids": results["ids"]
         }
         
-        # Processar metadados
-        if "metadatas" in results and results["metadatas"]:
-            for metadata in results["metadatas"]:
-                if metadata:
-                    # Contar por categoria
-                    category = metadata.get("category", "unknown")
-                    if category not in stats["categories"]:
-                        stats["categories"][category] = 0
-                    stats["categories"][category] += 1
-                    
-                    # Atualizar data da última modificação
-                    proc_date = metadata.get("processing_date")
-                    if proc_date and (not stats["last_update"] or proc_date > stats["last_update"]):
-                        stats["last_update"] = proc_date
-        
+        # Processar metadados: Counter agrega as categorias em C e um único
+        # max() resolve a última data, sem o branch + lookup duplo por linha
+        metadatas = results.get("metadatas")
+        if metadatas:
+            stats["categories"] = dict(Counter(
+                m.get("category", "unknown") for m in metadatas if m))
+            stats["last_update"] = max(
+                (m.get("processing_date") for m in metadatas
+                 if m and m.get("processing_date")),
+                default=None)
+
+        _stats_cache['data'] = stats
+        _stats_cache['dirty'] = False
         return stats
-        
+
     except Exception as e:
         print(f"Erro ao obter estatísticas: {str(e)}")
         return {
@@ -84,110 +190,193 @@ def get_database_stats():
 def clear_database():
     """Limpa o banco de dados"""
     try:
-        client.delete_collection("leaf_diseases")
-        collection = client.create_collection(
-            name="leaf_diseases",
-            metadata={"hnsw:space": "cosine"}
-        )
+        _client().delete_collection("leaf_diseases")
+        # Invalidar o handle cacheado e recriar a coleção imediatamente,
+        # para que as próximas chamadas não usem a coleção excluída
+        _collection.cache_clear()
+        _collection()
+        _stats_cache['data'] = None
+        _stats_cache['dirty'] = True
         return True
     except Exception as e:
         print(f"Erro ao limpar banco de dados: {str(e)}")
         return False
 
+# Categoria a partir do caminho: regex compilada (busca em C) + lru_cache,
+# já que os mesmos diretórios-pai se repetem em praticamente todo insert
+_LEAF_CATEGORY_RE = re.compile(r'leaf_[^/\\]*')
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_path_meta(path):
+    """Normaliza o caminho e extrai a categoria leaf_* dele, com cache"""
+    norm = os.path.normpath(path)
+    match = _LEAF_CATEGORY_RE.search(norm)
+    return norm, match.group(0) if match else None
+
 def add_embedding(id, embedding, metadata=None):
     """Adiciona um embedding ao banco de dados"""
     try:
-        # Normalizar o caminho no metadata
+        # Normalizar o caminho e extrair a categoria em uma passada cacheada
         if metadata and 'path' in metadata:
-            metadata['path'] = os.path.normpath(metadata['path'])
-            
-            # Extrair categoria do caminho
-            parts = metadata['path'].split(os.sep)
-            category = next((part for part in parts if 'leaf_' in part), None)
+            metadata['path'], category = _normalize_path_meta(metadata['path'])
             if category:
                 metadata['category'] = category
 
-        # Extrair características para exibição
-        features = extract_features(embedding)
-        
-        print(f"\nSalvando imagem no banco de dados:")
-        print(f"• Caminho: {metadata.get('path', 'N/A')}")
-        print(f"• Categoria: {metadata.get('category', 'N/A')}")
-        print(f"• Data: {metadata.get('processing_date', 'N/A')}")
-        
-        print("\nCaracterísticas extraídas:")
-        print(f"• Número de lesões: {features['shape']['num_lesions']:.2f}")
-        print(f"• Área afetada: {features['shape']['disease_coverage']:.2%}")
-        print(f"• Tamanho médio das lesões: {features['shape']['avg_lesion_size']:.2f}")
-        print(f"• Densidade de lesões: {features['shape']['lesion_density']:.2f}")
-        
-        print("\nEstatísticas de cor (HSV):")
-        print(f"• Matiz média: {features['hsv']['h_stats']['mean']:.2f}")
-        print(f"• Saturação média: {features['hsv']['s_stats']['mean']:.2f}")
-        print(f"• Valor médio: {features['hsv']['v_stats']['mean']:.2f}")
-        
-        print("\nCaracterísticas de textura:")
-        print(f"• Contraste: {features['glcm']['contrast']:.2f}")
-        print(f"• Energia: {features['glcm']['energy']:.2f}")
-        print(f"• Homogeneidade: {features['glcm']['homogeneity']:.2f}")
-        print("-" * 50)
-
-        collection.add(
-            embeddings=[embedding],
+        # Diagnóstico por inserção só quando o nível DEBUG está ativo;
+        # com logging desconfigurado isso vira uma comparação de inteiro e
+        # o extract_features (que só servia para os prints) nem roda
+        if logger.isEnabledFor(logging.DEBUG):
+            features = extract_features(embedding)
+
+            logger.debug("Salvando imagem no banco de dados:")
+            logger.debug("• Caminho: %s", metadata.get('path', 'N/A') if metadata else 'N/A')
+            logger.debug("• Categoria: %s", metadata.get('category', 'N/A') if metadata else 'N/A')
+            logger.debug("• Data: %s", metadata.get('processing_date', 'N/A') if metadata else 'N/A')
+
+            logger.debug("Características extraídas:")
+            logger.debug("• Número de lesões: %.2f", features['shape']['num_lesions'])
+            logger.debug("• Área afetada: %.2f%%", features['shape']['disease_coverage'] * 100)
+            logger.debug("• Tamanho médio das lesões: %.2f", features['shape']['avg_lesion_size'])
+            logger.debug("• Densidade de lesões: %.2f", features['shape']['lesion_density'])
+
+            logger.debug("Estatísticas de cor (HSV):")
+            logger.debug("• Matiz média: %.2f", features['hsv']['h_stats']['mean'])
+            logger.debug("• Saturação média: %.2f", features['hsv']['s_stats']['mean'])
+            logger.debug("• Valor médio: %.2f", features['hsv']['v_stats']['mean'])
+
+            logger.debug("Características de textura:")
+            logger.debug("• Contraste: %.2f", features['glcm']['contrast'])
+            logger.debug("• Energia: %.2f", features['glcm']['energy'])
+            logger.debug("• Homogeneidade: %.2f", features['glcm']['homogeneity'])
+
+        _collection().add(
+            embeddings=[_maybe_quantize(embedding)],
             ids=[id],
             metadatas=[metadata] if metadata else None
         )
+        _stats_record_insert([id], [metadata] if metadata else None)
         return True
     except Exception as e:
         print(f"Erro ao adicionar embedding: {str(e)}")
         return False
 
+def get_all_ids():
+    """Retorna o conjunto de ids já presentes na coleção"""
+    try:
+        # ids sempre vêm no retorno; o include enxuto evita desserializar
+        # os embeddings de toda a coleção só para listar os ids
+        results = _collection().get(include=["metadatas"])
+        if results and "ids" in results:
+            return set(results["ids"])
+        return set()
+    except Exception as e:
+        print(f"Erro ao listar ids do banco: {str(e)}")
+        return set()
+
+def get_all_embeddings():
+    """Retorna ids, embeddings e metadados de toda a coleção em uma leitura"""
+    try:
+        results = _collection().get(include=["embeddings", "metadatas"])
+        if results and "ids" in results:
+            return results["ids"], results["embeddings"], results["metadatas"]
+        return [], [], []
+    except Exception as e:
+        print(f"Erro ao ler embeddings do banco: {str(e)}")
+        return [], [], []
+
+def add_embeddings_batch(ids, embeddings, metadatas=None, batch_size=1000):
+    """Adiciona um lote de embeddings ao banco de dados em poucas transações.
+
+    Muito mais rápido que chamar add_embedding por imagem, pois cada
+    inserção individual paga o custo de uma transação completa no Chroma.
+    Lotes maiores que batch_size são divididos para não estourar o limite
+    de batch do chroma nem segurar uma transação gigante.
+    """
+    try:
+        if not ids:
+            return True
+
+        if QUANTIZE_EMBEDDINGS:
+            embeddings = [_maybe_quantize(embedding) for embedding in embeddings]
+
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            _collection().add(
+                embeddings=embeddings[start:end],
+                ids=ids[start:end],
+                metadatas=metadatas[start:end] if metadatas else None
+            )
+        _stats_record_insert(ids, metadatas)
+        return True
+    except Exception as e:
+        print(f"Erro ao adicionar lote de embeddings: {str(e)}")
+        return False
+
+# Só existem duas configurações de pesos de consulta (com e sem lesões);
+# construí-las uma vez no import evita realocar e preencher o vetor de
+# 128 posições a cada chamada
+_WEIGHTS_NONE = np.ones(128, dtype=np.float64)
+_WEIGHTS_LESION = np.ones(128, dtype=np.float64)
+_WEIGHTS_LESION[0:96] = 0.5     # Histograma completo é menos importante
+_WEIGHTS_LESION[96:108] = 2.0   # Estatísticas HSV são importantes para manchas
+_WEIGHTS_LESION[108:116] = 1.5  # Textura pode indicar necrose
+_WEIGHTS_LESION[120:128] = 2.0  # Forma é crucial para lesões
+
+def _weighted_query(query_embedding):
+    """Aplica os pesos por grupo de característica e normaliza a consulta.
+
+    Retorna (vetor ponderado e normalizado, has_lesions).
+    """
+    query_embedding = np.asarray(query_embedding, dtype=np.float64)
+
+    # Extrair características críticas
+    num_lesoes = query_embedding[120]      # Número de lesões
+    area_afetada = query_embedding[123]    # Área afetada (porcentagem)
+
+    # Determinar se a imagem tem lesões significativas
+    has_lesions = num_lesoes > 0 and area_afetada > 0.001  # Mais de 0.1% da área
+
+    # Aplicar o vetor de pesos pré-construído
+    weighted_query = query_embedding * (_WEIGHTS_LESION if has_lesions else _WEIGHTS_NONE)
+
+    # Normalizar: norma via produto interno (uma passada, sem o overhead
+    # de despacho do np.linalg.norm)
+    norm = np.sqrt(weighted_query @ weighted_query)
+    if norm > 0:
+        weighted_query = weighted_query / norm
+
+    return weighted_query, has_lesions
+
 def query_embedding(query_embedding, n_results=5, metadata=None):
     """Consulta embeddings similares no banco de dados"""
     try:
-        # Converter para numpy array
-        query_embedding = np.array(query_embedding)
-        
-        # Definir índices dos diferentes grupos de características
-        hsv_hist_indices = slice(0, 96)        # 96 valores dos histogramas HSV
-        hsv_stats_indices = slice(96, 108)     # 12 valores das estatísticas HSV
-        glcm_indices = slice(108, 116)         # 8 valores do GLCM
-        lbp_indices = slice(116, 120)          # 4 valores do LBP
-        shape_indices = slice(120, 128)        # 8 valores de forma
-
-        # Extrair características críticas
-        shape_features = query_embedding[shape_indices]
-        num_lesoes = shape_features[0]         # Número de lesões
-        area_afetada = shape_features[3]       # Área afetada (porcentagem)
-        
-        # Determinar se a imagem tem lesões significativas
-        has_lesions = num_lesoes > 0 and area_afetada > 0.001  # Mais de 0.1% da área
-        
-        # Definir pesos baseados nas características da imagem
-        weights = np.ones(len(query_embedding))
-        
-        # Se a imagem tem lesões, dar mais peso para características relevantes
-        if has_lesions:
-            weights[hsv_stats_indices] = 2.0  # Estatísticas HSV são importantes para manchas
-            weights[shape_indices] = 2.0      # Forma é crucial para lesões
-            weights[glcm_indices] = 1.5       # Textura pode indicar necrose
-            weights[hsv_hist_indices] = 0.5   # Histograma completo é menos importante
-        
-        # Aplicar pesos ao embedding
-        weighted_query = query_embedding * weights
-        
-        # Normalizar o embedding ponderado
-        norm = np.linalg.norm(weighted_query)
-        if norm > 0:
-            weighted_query = weighted_query / norm
-        
+        weighted_query, has_lesions = _weighted_query(query_embedding)
+
         # Consultar o banco de dados - buscar mais resultados para garantir que temos 5 válidos
-        results = collection.query(
+        # O asarray em _weighted_query é zero-copy para ndarrays contíguos;
+        # o .tolist() final permanece porque a validação do chromadb 0.3.29
+        # só aceita listas de floats como query_embeddings.
+        # O filtro de imagens de análise roda no servidor (where), então a
+        # sobrebusca cai de 3x para uma folga pequena para o corte de 40%
+        results = _collection().query(
             query_embeddings=[weighted_query.tolist()],
-            n_results=n_results * 3,  # Buscar mais resultados para garantir 5 válidos
-            include=["embeddings", "metadatas", "distances"]
+            n_results=n_results * 2 + 2,
+            where={"type": {"$ne": "leaf_disease_analysis"}},
+            include=["metadatas", "distances"]
         )
-        
+
+        # Buscar os embeddings em um get pontual pelos K ids retornados,
+        # em vez de pedir que a própria consulta ANN carregue o blob de
+        # embeddings junto do resultado; o get devolve em ordem própria,
+        # então o mapeamento por id restaura a ordem da consulta
+        top_ids = results["ids"][0]
+        if top_ids:
+            fetched = _collection().get(ids=top_ids, include=["embeddings"])
+            emb_by_id = dict(zip(fetched["ids"], fetched["embeddings"]))
+            results["embeddings"] = [[emb_by_id[i] for i in top_ids]]
+        else:
+            results["embeddings"] = [[]]
+
         # Adicionar metadados da imagem de consulta
         if results and 'metadatas' in results and results['metadatas']:
             if metadata:
@@ -200,22 +389,162 @@ def query_embedding(query_embedding, n_results=5, metadata=None):
                 })
         
         return results, has_lesions
-        
+
     except Exception as e:
         print(f"Erro ao consultar embedding: {str(e)}")
         return None, False
 
-def calculate_similarity(dist, emb1, emb2):
-    """Calcula similaridade considerando características específicas"""
-    # Extrair características relevantes
-    shape1 = emb1[120:128]
-    shape2 = emb2[120:128]
-    
-    num_lesoes1 = shape1[0]
-    num_lesoes2 = shape2[0]
-    area_afetada1 = shape1[3]  # Índice para área afetada
-    area_afetada2 = shape2[3]
-    
+def query_embeddings_batch(query_embeddings, n_results=5, metadatas=None):
+    """Consulta várias imagens em uma única chamada ao banco.
+
+    O collection.query aceita uma lista de embeddings e faz a travessia
+    HNSW em lote, bem mais barato que N chamadas independentes. Retorna
+    uma lista de (results, has_lesions) no mesmo formato de
+    query_embedding, um item por consulta.
+    """
+    try:
+        if not query_embeddings:
+            return []
+
+        weighted = []
+        lesions = []
+        for embedding in query_embeddings:
+            weighted_query, has_lesions = _weighted_query(embedding)
+            weighted.append(weighted_query.tolist())
+            lesions.append(has_lesions)
+
+        results = _collection().query(
+            query_embeddings=weighted,
+            n_results=n_results * 2 + 2,
+            where={"type": {"$ne": "leaf_disease_analysis"}},
+            include=["embeddings", "metadatas", "distances"]
+        )
+
+        per_query = []
+        for i, has_lesions in enumerate(lesions):
+            single = {
+                "ids": [results["ids"][i]],
+                "distances": [results["distances"][i]],
+                "embeddings": [results["embeddings"][i]],
+                "metadatas": [list(results["metadatas"][i])],
+            }
+            query_metadata = metadatas[i] if metadatas else {
+                "path": "image/uploads/query_leaf.jpg",
+                "type": "leaf_disease",
+                "processing_date": str(datetime.now())
+            }
+            single["metadatas"][0].insert(0, query_metadata)
+            per_query.append((single, has_lesions))
+
+        return per_query
+
+    except Exception as e:
+        print(f"Erro ao consultar lote de embeddings: {str(e)}")
+        return [(None, False)] * len(query_embeddings)
+
+# Matriz contígua de embeddings exportada da coleção: permite responder
+# consultas com um único produto matriz-vetor via memmap, sem pagar a
+# abertura do SQLite + carga do índice HNSW a cada processo
+_MEMMAP_PATH = os.path.join("database", "embeddings.f32")
+
+# Tamanho do bloco da varredura por força bruta: 4096 linhas x 128
+# float32 = 2 MiB, dimensionado para ficar residente em L2
+_SCAN_TILE = 4096
+_MEMMAP_META_PATH = os.path.join("database", "embeddings_meta.json")
+
+def export_to_memmap(path=_MEMMAP_PATH, meta_path=_MEMMAP_META_PATH):
+    """Exporta os embeddings da coleção para uma matriz float32 em disco.
+
+    Grava o binário [N, D] e um JSON ao lado com ids, metadados e o shape,
+    para consumo via np.memmap no caminho rápido de consulta.
+    """
+    try:
+        results = _collection().get(include=["embeddings", "metadatas"])
+        ids = results.get("ids") if results else None
+        if not ids:
+            print("Banco vazio: nada a exportar.")
+            return False
+        matrix = np.asarray(results["embeddings"], dtype=np.float32)
+        matrix.tofile(path)
+        with open(meta_path, "w") as f:
+            json.dump({
+                "ids": ids,
+                "shape": list(matrix.shape),
+                "metadatas": results.get("metadatas"),
+            }, f)
+        return True
+    except Exception as e:
+        print(f"Erro ao exportar embeddings para memmap: {str(e)}")
+        return False
+
+def query_embedding_memmap(query_embedding, n_results=5, metadata=None,
+                           path=_MEMMAP_PATH, meta_path=_MEMMAP_META_PATH):
+    """Consulta por força bruta sobre a matriz exportada via memmap.
+
+    A varredura anda em blocos de _SCAN_TILE linhas para o conjunto de
+    trabalho caber em L2 em vez de materializar as distâncias da matriz
+    inteira; um top-k corrente é mantido entre blocos com argpartition.
+    O resultado tem o mesmo formato devolvido por query_embedding, então
+    analyze_query_results funciona sem mudanças.
+    """
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        n, d = meta["shape"]
+        matrix = np.memmap(path, dtype="float32", mode="r", shape=(n, d))
+
+        weighted_query, has_lesions = _weighted_query(query_embedding)
+        q = weighted_query.astype(np.float32)
+
+        k = min(n_results * 3, n)
+        best_dist = np.empty(0, dtype=np.float32)
+        best_idx = np.empty(0, dtype=np.int64)
+        for start in range(0, n, _SCAN_TILE):
+            tile = np.asarray(matrix[start:start + _SCAN_TILE])
+            norms = np.linalg.norm(tile, axis=1)
+            norms[norms == 0] = 1.0
+            dist_tile = (1.0 - (tile @ q) / norms).astype(np.float32)
+
+            cand_dist = np.concatenate([best_dist, dist_tile])
+            cand_idx = np.concatenate(
+                [best_idx, np.arange(start, start + len(dist_tile))])
+            if len(cand_dist) > k:
+                keep = np.argpartition(cand_dist, k - 1)[:k]
+                cand_dist, cand_idx = cand_dist[keep], cand_idx[keep]
+            best_dist, best_idx = cand_dist, cand_idx
+
+        order = np.argsort(best_dist)
+        top = best_idx[order]
+        top_dist = best_dist[order]
+
+        results = {
+            "ids": [[meta["ids"][i] for i in top]],
+            "distances": [[float(dist) for dist in top_dist]],
+            "embeddings": [[np.asarray(matrix[i], dtype=float).tolist() for i in top]],
+            "metadatas": [[(meta["metadatas"] or [{}] * n)[i] for i in top]],
+        }
+        results["metadatas"][0].insert(0, metadata or {
+            "path": "image/uploads/query_leaf.jpg",
+            "type": "leaf_disease",
+            "processing_date": str(datetime.now())
+        })
+
+        return results, has_lesions
+
+    except Exception as e:
+        print(f"Erro ao consultar via memmap: {str(e)}")
+        return None, False
+
+# numba é opcional: quando instalado, o núcleo escalar da similaridade é
+# compilado (a escada de branches vira código de máquina); sem ele, a
+# função roda como Python puro, idêntica em resultado
+try:
+    from numba import njit as _njit
+except ImportError:
+    _njit = None
+
+def _similarity_core(dist, num_lesoes1, area_afetada1, num_lesoes2, area_afetada2):
+    """Núcleo escalar do cálculo de similaridade (JITável pelo numba)"""
     # Verificar se as imagens são saudáveis ou doentes
     is_healthy1 = num_lesoes1 <= 1 and area_afetada1 < 0.02  # Reduzido para 2% de área e máximo 1 lesão
     is_healthy2 = num_lesoes2 <= 1 and area_afetada2 < 0.02
@@ -304,8 +633,130 @@ def calculate_similarity(dist, emb1, emb2):
     
     # Limitar a similaridade máxima para evitar 100%
     final_similarity = min(95, final_similarity)
-    
-    return round(final_similarity, 1)
+
+    return final_similarity
+
+if _njit is not None:
+    _similarity_core = _njit(cache=True, fastmath=True)(_similarity_core)
+
+def calculate_similarity(dist, emb1, emb2):
+    """Calcula similaridade considerando características específicas"""
+    # Extrair características relevantes
+    shape1 = emb1[120:128]
+    shape2 = emb2[120:128]
+
+    return round(float(_similarity_core(
+        float(dist),
+        float(shape1[0]), float(shape1[3]),   # número de lesões / área afetada
+        float(shape2[0]), float(shape2[3]))), 1)
+
+# Tabelas das penalidades graduais: faixas de diferença -> fator aplicado
+# (searchsorted com side='left' mantém o mesmo corte "<=" da versão escalar)
+_LESION_TH = np.array([0, 2, 4, 6])
+_LESION_PEN = np.array([1.0, 0.9, 0.8, 0.7, 0.6])
+_AREA_TH = np.array([0, 0.05, 0.10, 0.15])
+_AREA_PEN = np.array([1.0, 0.95, 0.85, 0.75, 0.65])
+
+def calculate_similarities_batch(distances, query_emb, embeddings):
+    """Versão vetorizada de calculate_similarity para todos os candidatos.
+
+    Os embeddings viram uma matriz (K,128); o bloco de forma é fatiado como
+    colunas (SoA) e toda a escada de pesos/penalidades roda com operações
+    broadcast contra a linha de consulta, sem chamadas Python por item.
+    """
+    E = np.asarray(embeddings, dtype=np.float64)
+    d = np.asarray(distances, dtype=np.float64)
+
+    num_lesoes1 = float(query_emb[120])
+    area_afetada1 = float(query_emb[123])
+    num_lesoes2 = E[:, 120]
+    area_afetada2 = E[:, 123]
+
+    is_healthy1 = num_lesoes1 <= 1 and area_afetada1 < 0.02
+    is_healthy2 = (num_lesoes2 <= 1) & (area_afetada2 < 0.02)
+    has_sig1 = num_lesoes1 >= 3 or area_afetada1 > 0.05
+    has_sig2 = (num_lesoes2 >= 3) | (area_afetada2 > 0.05)
+
+    base_similarity = 100 * (1 - d)
+
+    lesion_diff = np.abs(num_lesoes1 - num_lesoes2)
+    max_lesoes = np.maximum(num_lesoes1, num_lesoes2)
+    lesion_similarity = np.where(
+        max_lesoes > 0,
+        100 * (1 - lesion_diff / (max_lesoes + 2)),
+        np.where(lesion_diff == 0, 100.0, 0.0))
+
+    area_diff = np.abs(area_afetada1 - area_afetada2)
+    area_similarity = 100 * (1 - np.minimum(1.0, area_diff / 0.2))
+
+    both_healthy = is_healthy1 & is_healthy2
+    both_diseased = has_sig1 & has_sig2
+    final = np.where(
+        both_healthy,
+        0.4 * base_similarity + 0.3 * lesion_similarity + 0.3 * area_similarity,
+        np.where(
+            both_diseased,
+            0.2 * base_similarity + 0.5 * lesion_similarity + 0.3 * area_similarity,
+            0.3 * base_similarity + 0.4 * lesion_similarity + 0.3 * area_similarity))
+    final = np.clip(final, 0, 100)
+
+    # Penalidades graduais pelas diferenças de lesões e de área: um único
+    # searchsorted nas tabelas de faixas substitui a cascata de comparações
+    final *= (_LESION_PEN[np.searchsorted(_LESION_TH, lesion_diff)]
+              * _AREA_PEN[np.searchsorted(_AREA_TH, area_diff)])
+
+    # Bônus para características muito próximas
+    bonus = (lesion_diff <= 2) & (area_diff <= 0.05)
+    final = np.where(bonus, np.minimum(100, final * 1.2), final)
+
+    # Mínimo de 30% entre folhas doentes e teto geral de 95%
+    final = np.where(both_diseased, np.maximum(30, final), final)
+    final = np.minimum(95, final)
+
+    # Saudável contra claramente doente domina qualquer outro ajuste
+    mismatch = (is_healthy1 & has_sig2) | (is_healthy2 & has_sig1)
+    final = np.where(mismatch, 5.0, final)
+
+    return np.round(final, 1)
+
+def _aggregate_category_stats(categories, similarities):
+    """Agrega contagem, soma e máximo de similaridade por categoria.
+
+    As reduções são feitas com np.bincount/np.maximum.at sobre ids
+    inteiros de categoria, em vez de um loop Python por imagem.
+    """
+    cat_index = {cat: i for i, cat in enumerate(dict.fromkeys(categories))}
+    ids = np.fromiter((cat_index[cat] for cat in categories),
+                      dtype=np.intp, count=len(categories))
+    sims = np.asarray(similarities, dtype=np.float64)
+
+    counts = np.bincount(ids, minlength=len(cat_index))
+    totals = np.bincount(ids, weights=sims, minlength=len(cat_index))
+    maxes = np.zeros(len(cat_index))
+    np.maximum.at(maxes, ids, sims)
+
+    total_sim = float(sims.sum())
+    return {
+        cat: {
+            'count': int(counts[i]),
+            'total_sim': float(totals[i]),
+            'max_sim': float(maxes[i]),
+            'percentage': round(float(totals[i]) / total_sim * 100, 1) if total_sim else 0.0,
+            'avg_similarity': round(float(totals[i]) / int(counts[i]), 1),
+        }
+        for cat, i in cat_index.items()
+    }
+
+@dataclass(slots=True)
+class _MetaView:
+    """Leitura dos metadados de um candidato com acesso por atributo.
+
+    Os .get com default viram um único parse na entrada; dentro do loop o
+    acesso é LOAD_ATTR em slot, bem mais barato que dict.get por campo.
+    """
+    path: str
+    category: str
+    type: str
 
 def analyze_query_results(results):
     """Analisa os resultados da consulta e retorna estatísticas"""
@@ -337,38 +788,62 @@ def analyze_query_results(results):
         print(f"Tamanho médio das lesões: {query_features['shape']['avg_lesion_size']:.2f}")
         print(f"Densidade de lesões: {query_features['shape']['lesion_density']:.2f}")
         
-        # Calcular similaridades considerando características
-        similarities = []
-        detailed_comparisons = []
-        
+        # Parse único dos metadados para vistas com slots; os .get com
+        # default saem do loop de candidatos
+        views = [_MetaView(path=(m or {}).get('path', 'Caminho desconhecido'),
+                           category=(m or {}).get('category', 'unknown'),
+                           type=(m or {}).get('type', ''))
+                 for m in metadatas]
+
         # Ignorar a primeira imagem (imagem de consulta) e imagens de análise
-        for i, (dist, emb, meta) in enumerate(zip(distances[1:], embeddings[1:], metadatas[1:]), 1):
-            # Ignorar imagens de análise
-            if meta.get('type') == 'leaf_disease_analysis':
+        candidates = [(i, emb, meta, views[i])
+                      for i, (emb, meta) in enumerate(
+                          zip(embeddings[1:], metadatas[1:]), 1)
+                      if views[i].type != 'leaf_disease_analysis']
+
+        if not candidates:
+            return None
+
+        # Todas as similaridades de uma vez: os embeddings dos candidatos
+        # são empilhados em uma matriz e o cálculo roda vetorizado
+        similarities = calculate_similarities_batch(
+            [distances[i] for i, _, _, _ in candidates],
+            np.asarray(query_emb),
+            [emb for _, emb, _, _ in candidates]).tolist()
+
+        # Filtrar resultados com similaridade muito baixa antes de qualquer
+        # trabalho por candidato: quem fica abaixo do corte nem gera as
+        # diferenças nem entra em detailed_comparisons
+        min_similarity = 40
+
+        detailed_comparisons = []
+        kept = []  # (índice original, embedding, metadado, similaridade)
+
+        for (i, emb, meta, view), sim in zip(candidates, similarities):
+            if sim < min_similarity:
                 continue
-                
-            sim = calculate_similarity(dist, query_emb, emb)
-            similarities.append(sim)
-            
-            # Extrair características da imagem comparada
-            comp_features = extract_features(emb)
-            
+
+            # Ler os escalares da imagem comparada por vistas zero-copy;
+            # o dict completo só é montado para os candidatos que passarem
+            # do filtro de similaridade mínima
+            comp_views = extract_feature_views(emb)
+
             # Calcular diferenças principais
-            shape_diff = abs(query_features['shape']['num_lesions'] - comp_features['shape']['num_lesions'])
-            area_diff = abs(query_features['shape']['disease_coverage'] - comp_features['shape']['disease_coverage'])
-            texture_diff = abs(query_features['glcm']['contrast'] - comp_features['glcm']['contrast'])
-            color_diff = abs(query_features['hsv']['h_stats']['mean'] - comp_features['hsv']['h_stats']['mean'])
-            
+            shape_diff = abs(query_features['shape']['num_lesions'] - float(comp_views.shape[0]))
+            area_diff = abs(query_features['shape']['disease_coverage'] - float(comp_views.shape[3]))
+            texture_diff = abs(query_features['glcm']['contrast'] - float(comp_views.glcm[0]))
+            color_diff = abs(query_features['hsv']['h_stats']['mean'] - float(comp_views.hsv_stats[0]))
+
             # Obter o caminho da imagem comparada
-            comp_path = meta.get('path', 'Caminho desconhecido')
-            
+            comp_path = view.path
+
             # Normalizar a categoria para leaf_healthy ou leaf_with_disease
-            category = meta.get('category', 'unknown')
+            category = view.category
             if 'healthy' in category.lower():
                 category = 'leaf_healthy'
             elif category != 'query':
                 category = 'leaf_with_disease'
-            
+
             detailed_comparisons.append({
                 'index': i,
                 'category': category,
@@ -379,25 +854,24 @@ def analyze_query_results(results):
                     'area_diff': area_diff,
                     'texture_diff': texture_diff,
                     'color_diff': color_diff
-                },
-                'features': comp_features
+                }
             })
-        
-        # Filtrar resultados com similaridade muito baixa
-        min_similarity = 40
-        valid_indices = [i for i, sim in enumerate(similarities) if sim >= min_similarity]
-        
-        if not valid_indices:
+            kept.append((i, emb, meta, sim))
+
+        if not kept:
             return None
-        
-        # Filtrar resultados
-        similarities = [similarities[i] for i in valid_indices]
-        categories = [detailed_comparisons[i]['category'] for i in valid_indices]
-        filtered_ids = [ids[i+1] for i in valid_indices]
-        filtered_metadatas = [metadatas[i+1] for i in valid_indices]
-        filtered_embeddings = [embeddings[i+1] for i in valid_indices]
-        
-        # Ordenar imagens similares por similaridade
+
+        # Listas paralelas dos sobreviventes do filtro; o índice original
+        # de cada candidato vem da própria lista, então imagens de análise
+        # puladas não desalinham ids/metadados/embeddings
+        similarities = [sim for _, _, _, sim in kept]
+        categories = [comp['category'] for comp in detailed_comparisons]
+        filtered_ids = [ids[i] for i, _, _, _ in kept]
+        filtered_metadatas = [meta for _, _, meta, _ in kept]
+        filtered_features = [extract_features(emb) for _, emb, _, _ in kept]
+
+        # Montar as imagens similares; o dict completo de características
+        # é extraído apenas para os candidatos que sobreviveram ao filtro
         similar_images = [
             {
                 'id': id_,
@@ -405,52 +879,35 @@ def analyze_query_results(results):
                 'path': meta.get('path', 'Caminho desconhecido'),
                 'similarity': sim,
                 'metadata': meta,
-                'features': extract_features(emb)
+                'features': features
             }
-            for id_, cat, sim, meta, emb in zip(filtered_ids, categories, similarities, 
-                                               filtered_metadatas, filtered_embeddings)
+            for id_, cat, sim, meta, features in zip(filtered_ids, categories, similarities,
+                                                     filtered_metadatas, filtered_features)
         ]
         
-        # Ordenar por similaridade decrescente
-        similar_images.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        # Pegar as 5 imagens mais similares
-        top_5_images = similar_images[:5]
-        
-        # Calcular estatísticas apenas das 5 imagens mais similares
-        category_stats = {}
-        total_sim = sum(img['similarity'] for img in top_5_images)
-        
-        for img in top_5_images:
-            cat = img['category']
-            sim = img['similarity']
-            
-            if cat not in category_stats:
-                category_stats[cat] = {'count': 0, 'total_sim': 0, 'max_sim': 0}
-            
-            category_stats[cat]['count'] += 1
-            category_stats[cat]['total_sim'] += sim
-            category_stats[cat]['max_sim'] = max(category_stats[cat]['max_sim'], sim)
-        
-        # Calcular métricas finais
-        for cat, stats in category_stats.items():
-            stats['percentage'] = round((stats['total_sim'] / total_sim * 100), 1)
-            stats['avg_similarity'] = round(stats['total_sim'] / stats['count'], 1)
+        # Selecionar as 5 imagens mais similares com argpartition (seleção
+        # parcial O(K)) e ordenar apenas o top-5 resultante
+        sims_arr = np.asarray(similarities, dtype=np.float32)
+        k = min(5, len(sims_arr))
+        top_idx = np.argpartition(-sims_arr, k - 1)[:k]
+        top_idx = top_idx[np.argsort(-sims_arr[top_idx])]
+        top_5_images = [similar_images[i] for i in top_idx]
         
+        # Calcular estatísticas apenas das 5 imagens mais similares,
+        # com as reduções agregadas de uma vez em numpy
+        category_stats = _aggregate_category_stats(
+            [img['category'] for img in top_5_images],
+            [img['similarity'] for img in top_5_images])
+
         # Determinar categoria baseado nas 5 imagens mais similares
         if len(top_5_images) > 0:
             # Usar a categoria da imagem mais similar como base
             best_category = top_5_images[0]['category']
             
-            # Se houver pelo menos 3 imagens da mesma categoria nas top 5, usar essa categoria
-            category_counts = {}
-            for img in top_5_images:
-                cat = img['category']
-                category_counts[cat] = category_counts.get(cat, 0) + 1
-            
-            # Se uma categoria tem maioria (3 ou mais), usar ela
-            for cat, count in category_counts.items():
-                if count >= 3:
+            # Se houver pelo menos 3 imagens da mesma categoria nas top 5,
+            # usar essa categoria; as contagens já estão em category_stats
+            for cat, stats in category_stats.items():
+                if stats['count'] >= 3:
                     best_category = cat
                     break
         else:
@@ -516,7 +973,7 @@ def analyze_query_results(results):
         return {
             'identified_category': best_category,
             'confidence': confidence,
-            'best_match': round(max(similarities), 1),
+            'best_match': round(float(sims_arr[top_idx[0]]), 1),
             'category_distribution': {
                 cat: stats['percentage']
                 for cat, stats in category_stats.items()
@@ -528,21 +985,35 @@ def analyze_query_results(results):
         print(f"Erro ao analisar resultados: {str(e)}")
         return None
 
+# Pontos de corte do embedding de 128-D, definidos uma única vez:
+# [0:96] histogramas HSV, [96:108] estatísticas HSV, [108:116] GLCM,
+# [116:120] LBP, [120:128] forma
+_SPLIT_POINTS = [96, 108, 116, 120]
+
+# Vistas zero-copy sobre os grupos de um embedding: nenhum dict aninhado
+# nem boxing de floats, só fatias numpy compartilhando a memória do vetor
+FeatureViews = namedtuple('FeatureViews', 'hsv_hist hsv_stats glcm lbp shape')
+
+def extract_feature_views(embedding):
+    """Retorna fatias zero-copy dos grupos de características.
+
+    Para caminhos quentes que só leem alguns escalares (diffs, prints),
+    evita as ~30 alocações de objetos Python que extract_features faz.
+    """
+    if not isinstance(embedding, np.ndarray):
+        embedding = np.asarray(embedding)
+    return FeatureViews(*np.split(embedding, _SPLIT_POINTS))
+
 def extract_features(embedding):
     """Extrai e formata as características do embedding"""
     # Converter para numpy array se necessário
     if not isinstance(embedding, np.ndarray):
         embedding = np.array(embedding)
-    
-    # Definir índices dos diferentes grupos de características
-    hsv_hist_indices = slice(0, 96)        # 96 valores dos histogramas HSV
-    hsv_stats_indices = slice(96, 108)     # 12 valores das estatísticas HSV
-    glcm_indices = slice(108, 116)         # 8 valores do GLCM
-    lbp_indices = slice(116, 120)          # 4 valores do LBP
-    shape_indices = slice(120, 128)        # 8 valores de forma
-    
+
+    # Um único np.split devolve as cinco vistas dos grupos de uma vez
+    _, hsv_stats, glcm, lbp, shape = np.split(embedding, _SPLIT_POINTS)
+
     # Extrair características HSV
-    hsv_stats = embedding[hsv_stats_indices]
     hsv_features = {
         'h_stats': {
             'mean': float(hsv_stats[0]),
@@ -566,34 +1037,34 @@ def extract_features(embedding):
     
     # Extrair características GLCM
     glcm_features = {
-        'contrast': float(embedding[glcm_indices][0]),
-        'correlation': float(embedding[glcm_indices][1]),
-        'energy': float(embedding[glcm_indices][2]),
-        'homogeneity': float(embedding[glcm_indices][3]),
-        'dissimilarity': float(embedding[glcm_indices][4]),
-        'entropy': float(embedding[glcm_indices][5]),
-        'cluster_shade': float(embedding[glcm_indices][6]),
-        'cluster_prominence': float(embedding[glcm_indices][7])
+        'contrast': float(glcm[0]),
+        'correlation': float(glcm[1]),
+        'energy': float(glcm[2]),
+        'homogeneity': float(glcm[3]),
+        'dissimilarity': float(glcm[4]),
+        'entropy': float(glcm[5]),
+        'cluster_shade': float(glcm[6]),
+        'cluster_prominence': float(glcm[7])
     }
-    
+
     # Extrair características LBP
     lbp_features = {
-        'mean': float(embedding[lbp_indices][0]),
-        'std': float(embedding[lbp_indices][1]),
-        'energy': float(embedding[lbp_indices][2]),
-        'entropy': float(embedding[lbp_indices][3])
+        'mean': float(lbp[0]),
+        'std': float(lbp[1]),
+        'energy': float(lbp[2]),
+        'entropy': float(lbp[3])
     }
-    
+
     # Extrair características de forma
     shape_features = {
-        'num_lesions': float(embedding[shape_indices][0]),
-        'avg_lesion_size': float(embedding[shape_indices][1]),
-        'lesion_size_std': float(embedding[shape_indices][2]),
-        'disease_coverage': float(embedding[shape_indices][3]),
-        'lesion_density': float(embedding[shape_indices][4]),
-        'avg_compactness': float(embedding[shape_indices][5]),
-        'avg_distance': float(embedding[shape_indices][6]),
-        'std_distance': float(embedding[shape_indices][7])
+        'num_lesions': float(shape[0]),
+        'avg_lesion_size': float(shape[1]),
+        'lesion_size_std': float(shape[2]),
+        'disease_coverage': float(shape[3]),
+        'lesion_density': float(shape[4]),
+        'avg_compactness': float(shape[5]),
+        'avg_distance': float(shape[6]),
+        'std_distance': float(shape[7])
     }
     
     return {
@@ -606,7 +1077,7 @@ def extract_features(embedding):
 def get_embedding_by_id(image_id):
     """Recupera um embedding e seus metadados pelo ID."""
     try:
-        results = collection.get(
+        results = _collection().get(
             ids=[image_id],
             include=["embeddings", "metadatas"]
         )
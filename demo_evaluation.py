@@ -14,10 +14,32 @@ Funcionalidades demonstradas:
 
 import os
 import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from evaluation_system import CBIREvaluationSystem
 from database import chroma
 from engine import processing_engine as engine
+from engine.proximity_cache import ProximityCache
+from engine import embedding_cache
+
+# Cache de proximidade compartilhado entre as iterações do menu: consultas
+# quase idênticas reaproveitam os vizinhos sem tocar no banco vetorial
+_proximity_cache = ProximityCache(max_size=512, tolerance=0.05)
+
+_evaluator = None
+
+# Executor de uma vaga para rodar a avaliação completa em segundo plano,
+# devolvendo o menu ao usuário enquanto as imagens são processadas
+_eval_executor = ThreadPoolExecutor(max_workers=1)
+_eval_future = None
+
+def _get_evaluator():
+    """Instância única de CBIREvaluationSystem reusada entre opções do menu"""
+    global _evaluator
+    if _evaluator is None:
+        _evaluator = CBIREvaluationSystem()
+    return _evaluator
 
 def print_header(title):
     """Imprime um cabeçalho formatado"""
@@ -35,9 +57,9 @@ def demo_revocation_prediction():
     """Demonstra a previsão de revogação"""
     print_header("DEMONSTRAÇÃO: PREVISÃO DE REVOGAÇÃO")
     
-    # Criar sistema de avaliação
-    evaluator = CBIREvaluationSystem()
-    
+    # Sistema de avaliação compartilhado entre as iterações do menu
+    evaluator = _get_evaluator()
+
     # Verificar se há imagens no banco
     stats = chroma.get_database_stats()
     if stats["total_images"] == 0:
@@ -60,13 +82,21 @@ def demo_revocation_prediction():
     # Processar imagem de consulta
     print_section("PROCESSANDO IMAGEM DE CONSULTA")
     try:
-        result = engine.process_image(query_path, save_to_db=False, visualize=False)
-        
-        if "error" in result:
-            print(f"❌ Erro ao processar imagem: {result['error']}")
-            return
-        
-        print("✅ Imagem processada com sucesso")
+        # Reaproveitar o embedding se o arquivo não mudou desde a última demo
+        cache_key = embedding_cache.content_key(query_path)
+        cached_features = embedding_cache.get(cache_key)
+        if cached_features is not None:
+            result = {"features": cached_features}
+            print("✅ Embedding reaproveitado do cache")
+        else:
+            result = engine.process_image(query_path, save_to_db=False, visualize=False)
+
+            if "error" in result:
+                print(f"❌ Erro ao processar imagem: {result['error']}")
+                return
+
+            embedding_cache.set(cache_key, result["features"])
+            print("✅ Imagem processada com sucesso")
         
         # Consultar banco de dados
         from datetime import datetime
@@ -77,7 +107,8 @@ def demo_revocation_prediction():
             "category": "demo"
         }
         
-        query_results = chroma.query_embedding(result["features"], metadata=query_metadata)
+        query_results = _proximity_cache.query(
+            result["features"], fallback=chroma.query_embedding, metadata=query_metadata)
         
         if not query_results:
             print("❌ Erro ao consultar banco de dados")
@@ -165,13 +196,13 @@ def demo_system_evaluation():
     
     print(f"✅ Dataset de teste encontrado: {test_dataset}")
     
-    # Contar imagens de teste
-    test_images = []
-    for category_dir in Path(test_dataset).iterdir():
-        if category_dir.is_dir():
-            category_images = list(category_dir.glob('*.jpg')) + list(category_dir.glob('*.png'))
-            test_images.extend(category_images)
-            print(f"  • {category_dir.name}: {len(category_images)} imagens")
+    # Contar imagens de teste em uma única varredura (em vez de dois
+    # globs sequenciais por categoria)
+    test_images = [p for p in Path(test_dataset).rglob('*')
+                   if p.suffix.lower() in {'.jpg', '.jpeg', '.png'}]
+    per_category = Counter(p.parent.name for p in test_images)
+    for category_name, count in sorted(per_category.items()):
+        print(f"  • {category_name}: {count} imagens")
     
     if not test_images:
         print("❌ Nenhuma imagem de teste encontrada")
@@ -179,15 +210,21 @@ def demo_system_evaluation():
     
     print(f"✅ Total de imagens de teste: {len(test_images)}")
     
-    # Criar sistema de avaliação
-    evaluator = CBIREvaluationSystem()
-    
+    # Sistema de avaliação compartilhado entre as iterações do menu
+    evaluator = _get_evaluator()
+
     # Executar avaliação
     print_section("EXECUTANDO AVALIAÇÃO")
     print("Isso pode levar alguns minutos...")
     
     try:
-        evaluation_result = evaluator.evaluate_system_performance(test_dataset, None)
+        if "--batched" in sys.argv:
+            # Caminho em lote: todas as similaridades em um único Q @ E.T
+            evaluation_result = evaluator.evaluate_system_performance_batched(
+                test_dataset, workers=os.cpu_count())
+        else:
+            evaluation_result = evaluator.evaluate_system_performance(
+                test_dataset, None, workers=os.cpu_count())
         
         if not evaluation_result:
             print("❌ Falha na avaliação do sistema")
@@ -280,11 +317,13 @@ def demo_usage_instructions():
 
 def main():
     """Função principal da demonstração"""
+    global _eval_future
+
     print_header("SISTEMA DE AVALIAÇÃO CBIR - DEMONSTRAÇÃO")
-    
+
     print("Este script demonstra as funcionalidades do sistema de avaliação")
     print("e previsão de revogação implementado para o CBIR.")
-    
+
     while True:
         print("\n" + "="*40)
         print("OPÇÕES DE DEMONSTRAÇÃO:")
@@ -292,21 +331,38 @@ def main():
         print("2. Avaliação completa do sistema")
         print("3. Instruções de uso")
         print("4. Sair")
+        print("5. Status da avaliação em andamento")
         print("="*40)
-        
-        choice = input("\nEscolha uma opção (1-4): ").strip()
-        
+
+        choice = input("\nEscolha uma opção (1-5): ").strip()
+
         if choice == "1":
             demo_revocation_prediction()
         elif choice == "2":
-            demo_system_evaluation()
+            # Rodar em segundo plano para o menu continuar responsivo
+            if _eval_future is not None and not _eval_future.done():
+                print("⚠️ Já existe uma avaliação em andamento (opção 5 mostra o status)")
+            else:
+                _eval_future = _eval_executor.submit(demo_system_evaluation)
+                print("✅ Avaliação iniciada em segundo plano (opção 5 mostra o status)")
         elif choice == "3":
             demo_usage_instructions()
         elif choice == "4":
+            if _eval_future is not None and not _eval_future.done():
+                print("⏳ Aguardando a avaliação em andamento terminar...")
+                _eval_future.result()
+            _eval_executor.shutdown()
             print("\n👋 Obrigado por usar o sistema de avaliação CBIR!")
             break
+        elif choice == "5":
+            if _eval_future is None:
+                print("Nenhuma avaliação foi iniciada nesta sessão")
+            elif _eval_future.done():
+                print("✅ Avaliação concluída (resultados acima)")
+            else:
+                print("⏳ Avaliação ainda em andamento...")
         else:
-            print("❌ Opção inválida. Escolha 1, 2, 3 ou 4.")
+            print("❌ Opção inválida. Escolha 1, 2, 3, 4 ou 5.")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""
+Cache persistente de embeddings de imagens de consulta.
+
+Os vetores de características são indexados pelo sha256 do conteúdo do
+arquivo, então repetir a demo ou a avaliação sobre as mesmas imagens pula
+a extração de características (a etapa mais cara) e reusa o vetor salvo.
+O cache fica em cache/embeddings.pkl e é gravado ao final de cada uso.
+"""
+
+import os
+import pickle
+import hashlib
+
+_CACHE_PATH = os.path.join("cache", "embeddings.pkl")
+_MAX_ENTRIES = 2048
+
+_cache = None
+
+def _load():
+    global _cache
+    if _cache is None:
+        try:
+            with open(_CACHE_PATH, 'rb') as handle:
+                _cache = pickle.load(handle)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            _cache = {}
+    return _cache
+
+def _save():
+    try:
+        os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+        with open(_CACHE_PATH, 'wb') as handle:
+            pickle.dump(_cache, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        print(f"Aviso: não foi possível salvar o cache de embeddings: {str(e)}")
+
+def content_key(image_path):
+    """Chave de cache pelo hash do conteúdo do arquivo"""
+    with open(image_path, 'rb') as handle:
+        return hashlib.sha256(handle.read()).hexdigest()
+
+def get(key):
+    """Retorna o embedding salvo para a chave, ou None"""
+    return _load().get(key)
+
+def set(key, features):
+    """Guarda o embedding e persiste o cache em disco"""
+    set_many([(key, features)])
+
+def set_many(items):
+    """Guarda vários embeddings persistindo o cache uma única vez.
+
+    items é um iterável de pares (chave, features). Preferir a chamar
+    set() em loop, que regrava o arquivo inteiro a cada item.
+    """
+    cache = _load()
+    cache.update(items)
+    if len(cache) > _MAX_ENTRIES:
+        # descarta as entradas mais antigas (dicts preservam ordem de inserção)
+        for old_key in list(cache.keys())[:len(cache) - _MAX_ENTRIES]:
+            del cache[old_key]
+    _save()
+
+def get_features(image_path, extractor):
+    """Retorna o vetor de características da imagem, extraindo só na falta.
+
+    extractor recebe o caminho e devolve o vetor (ex.:
+    engine.process_image_features_only).
+    """
+    key = content_key(image_path)
+    features = get(key)
+    if features is None:
+        features = extractor(image_path)
+        if features is not None:
+            set(key, features)
+    return features
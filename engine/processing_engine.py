@@ -1,47 +1,122 @@
-import threading
+import atexit
 import cv2
+import hashlib
+import multiprocessing
+import queue
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy.spatial.distance import pdist
 from database import chroma
 from datetime import datetime
-import matplotlib.pyplot as plt
 import os
 
+# Arrays de forma fixa pré-computados no import (as imagens são sempre
+# redimensionadas para 224x224): limites de cor da segmentação, kernels
+# morfológicos e índices da matriz de co-ocorrência quantizada
+_GREEN_LOWER = np.array([25, 40, 40])
+_GREEN_UPPER = np.array([85, 255, 255])
+_KERNEL_H5 = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 1))
+_KERNEL_V5 = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 5))
+_KERNEL3 = np.ones((3, 3), np.uint8)
+_KERNEL5 = np.ones((5, 5), np.uint8)
+_GLCM_I, _GLCM_J = np.meshgrid(np.arange(32), np.arange(32), indexing='ij')
+
+# Nomes das 128 características, na mesma ordem das fatias do vetor; o
+# layout é fixo, então a lista é montada uma única vez no import
+_FEATURE_NAMES = (
+    [f'Matiz_bin_{i}' for i in range(32)]
+    + [f'Saturacao_bin_{i}' for i in range(32)]
+    + [f'Valor_bin_{i}' for i in range(32)]
+    + ['H_media', 'H_desvio', 'H_q25', 'H_q75',
+       'S_media', 'S_desvio', 'S_q25', 'S_q75',
+       'V_media', 'V_desvio', 'V_q25', 'V_q75',
+       'GLCM_Contraste', 'GLCM_Correlacao', 'GLCM_Energia', 'GLCM_Homogeneidade',
+       'GLCM_Dissimilaridade', 'GLCM_Entropia', 'GLCM_Cluster_Shade', 'GLCM_Cluster_Prominence',
+       'LBP_Media', 'LBP_Desvio', 'LBP_Energia', 'LBP_Entropia',
+       'Num_Lesoes', 'Tamanho_Medio', 'Desvio_Tamanho',
+       'Area_Afetada', 'Densidade_Lesoes', 'Circularidade',
+       'Dist_Media_Lesoes', 'Desvio_Dist_Lesoes'])
+
 def segment_leaf(image):
     """Segmenta a folha do fundo"""
     # Converter para HSV para melhor segmentação de verde
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    
-    # Definir range para cor verde (folha)
-    lower_green = np.array([25, 40, 40])
-    upper_green = np.array([85, 255, 255])
-    
-    # Criar máscara para região verde
-    mask = cv2.inRange(hsv, lower_green, upper_green)
-    
-    # Aplicar operações morfológicas para limpar a máscara
-    kernel = np.ones((5,5), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+    # Criar máscara para região verde (folha)
+    mask = cv2.inRange(hsv, _GREEN_LOWER, _GREEN_UPPER)
+
+    # Aplicar operações morfológicas para limpar a máscara. O kernel
+    # retangular 5x5 é separável: cada passada vira uma 5x1 + uma 1x5
+    # (de K² para 2K comparações por pixel), com resultado idêntico
+
+    # MORPH_CLOSE: dilatar e depois erodir
+    mask = cv2.dilate(cv2.dilate(mask, _KERNEL_H5), _KERNEL_V5)
+    mask = cv2.erode(cv2.erode(mask, _KERNEL_H5), _KERNEL_V5)
+
+    # MORPH_OPEN: erodir e depois dilatar
+    mask = cv2.erode(cv2.erode(mask, _KERNEL_H5), _KERNEL_V5)
+    mask = cv2.dilate(cv2.dilate(mask, _KERNEL_H5), _KERNEL_V5)
     
     return mask
 
 def extract_disease_features(image, mask, image_path=None):
     """Extrai características específicas para identificação de doenças"""
-    # Aplicar máscara na imagem
-    leaf_region = cv2.bitwise_and(image, image, mask=mask)
-    
-    # Converter para diferentes espaços de cor para análise
-    hsv = cv2.cvtColor(leaf_region, cv2.COLOR_BGR2HSV)
-    lab = cv2.cvtColor(leaf_region, cv2.COLOR_BGR2LAB)
-    
-    features = []
-    feature_names = []
+    # Saída rápida quando a máscara está vazia (nenhum verde detectado):
+    # todas as reduções sairiam nulas, então devolve direto o vetor zerado
+    # sem pagar conversões de cor, histogramas, morfologia e contornos
+    if not mask.any():
+        return np.zeros(128, dtype=np.float32), _FEATURE_NAMES
+
+    # Converter a imagem original uma única vez para cada espaço de cor.
+    # As reduções e histogramas são restritos por valid_mask, então não é
+    # preciso zerar o fundo com bitwise_and (economiza a alocação de
+    # leaf_region e as conversões derivadas dela)
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
     
+    # Vetor de características de tamanho fixo (96 hist + 12 stats + 8 GLCM
+    # + 4 LBP + 8 forma = 128), preenchido por fatias em vez de uma lista
+    # Python convertida no final
+    features = np.empty(128, dtype=np.float32)
+
+    h_channel = hsv[:,:,0]
+    s_channel = hsv[:,:,1]
+    v_channel = hsv[:,:,2]
+
+    valid_mask = mask > 0
+
+    # Materializar cada canal mascarado uma única vez; histogramas,
+    # estatísticas e quantis saem dos mesmos arrays
+    h_vals = h_channel[valid_mask]
+    s_vals = s_channel[valid_mask]
+    v_vals = v_channel[valid_mask]
+
+    # Média/desvio de cada canal calculados uma única vez: as listas de
+    # estatísticas e os limiares adaptativos de detect_disease_regions
+    # reutilizam os mesmos escalares (HSV e LAB)
+    h_mean, h_std = h_vals.mean(), h_vals.std()
+    s_mean, s_std = s_vals.mean(), s_vals.std()
+    v_mean, v_std = v_vals.mean(), v_vals.std()
+
+    l_channel = lab[:,:,0]
+    a_channel = lab[:,:,1]
+    b_channel = lab[:,:,2]
+    l_vals = l_channel[valid_mask]
+    a_vals = a_channel[valid_mask]
+    b_vals = b_channel[valid_mask]
+    l_mean, l_std = l_vals.mean(), l_vals.std()
+    a_mean, a_std = a_vals.mean(), a_vals.std()
+    b_mean, b_std = b_vals.mean(), b_vals.std()
+
     # 1. Características de cor (HSV - melhor para detectar manchas e descoloração)
-    h_hist = cv2.calcHist([hsv], [0], mask, [32], [0, 180])
-    s_hist = cv2.calcHist([hsv], [1], mask, [32], [0, 256])
-    v_hist = cv2.calcHist([hsv], [2], mask, [32], [0, 256])
-    
+    # Histogramas de 32 bins via np.bincount sobre os canais já mascarados,
+    # sem as três chamadas de cv2.calcHist (H vai de 0-179, S/V de 0-255)
+    h_hist = np.bincount(
+        h_vals.astype(np.uint16) * 32 // 180, minlength=32).astype(np.float32)
+    s_hist = np.bincount(s_vals >> 3, minlength=32).astype(np.float32)
+    v_hist = np.bincount(v_vals >> 3, minlength=32).astype(np.float32)
+
     # Normalizar histogramas pelo número total de pixels
     total_pixels = np.sum(mask) / 255.0
     if total_pixels > 0:
@@ -52,54 +127,25 @@ def extract_disease_features(image, mask, image_path=None):
         h_hist_norm = h_hist
         s_hist_norm = s_hist
         v_hist_norm = v_hist
-    
-    # Adicionar estatísticas dos canais HSV
-    h_channel = hsv[:,:,0]
-    s_channel = hsv[:,:,1]
-    v_channel = hsv[:,:,2]
-    
-    valid_mask = mask > 0
-    
+
     # Estatísticas do canal H (matiz)
-    h_stats = [
-        np.mean(h_channel[valid_mask]),
-        np.std(h_channel[valid_mask]),
-        np.percentile(h_channel[valid_mask], 25),
-        np.percentile(h_channel[valid_mask], 75)
-    ]
-    
+    h_stats = [h_mean, h_std, *np.quantile(h_vals, [0.25, 0.75])]
+
     # Estatísticas do canal S (saturação)
-    s_stats = [
-        np.mean(s_channel[valid_mask]),
-        np.std(s_channel[valid_mask]),
-        np.percentile(s_channel[valid_mask], 25),
-        np.percentile(s_channel[valid_mask], 75)
-    ]
-    
+    s_stats = [s_mean, s_std, *np.quantile(s_vals, [0.25, 0.75])]
+
     # Estatísticas do canal V (valor)
-    v_stats = [
-        np.mean(v_channel[valid_mask]),
-        np.std(v_channel[valid_mask]),
-        np.percentile(v_channel[valid_mask], 25),
-        np.percentile(v_channel[valid_mask], 75)
-    ]
-    
-    features.extend(h_hist_norm.flatten())
-    features.extend(s_hist_norm.flatten())
-    features.extend(v_hist_norm.flatten())
-    features.extend(h_stats)
-    features.extend(s_stats)
-    features.extend(v_stats)
-    
-    feature_names.extend([f'Matiz_bin_{i}' for i in range(32)])
-    feature_names.extend([f'Saturacao_bin_{i}' for i in range(32)])
-    feature_names.extend([f'Valor_bin_{i}' for i in range(32)])
-    feature_names.extend(['H_media', 'H_desvio', 'H_q25', 'H_q75'])
-    feature_names.extend(['S_media', 'S_desvio', 'S_q25', 'S_q75'])
-    feature_names.extend(['V_media', 'V_desvio', 'V_q25', 'V_q75'])
-    
+    v_stats = [v_mean, v_std, *np.quantile(v_vals, [0.25, 0.75])]
+    
+    features[0:32] = h_hist_norm
+    features[32:64] = s_hist_norm
+    features[64:96] = v_hist_norm
+    features[96:100] = h_stats
+    features[100:104] = s_stats
+    features[104:108] = v_stats
+
     # 2. Características de textura melhoradas
-    gray = cv2.cvtColor(leaf_region, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     
     # Detectar regiões doentes usando múltiplos critérios
     def detect_disease_regions():
@@ -107,14 +153,9 @@ def extract_disease_features(image, mask, image_path=None):
         # 1. Análise HSV adaptativa
         hsv_mask = np.zeros_like(mask)
         
-        # Calcular limiares adaptativos baseados na distribuição de cores
-        h_mean = np.mean(h_channel[valid_mask])
-        h_std = np.std(h_channel[valid_mask])
-        s_mean = np.mean(s_channel[valid_mask])
-        s_std = np.std(s_channel[valid_mask])
-        v_mean = np.mean(v_channel[valid_mask])
-        v_std = np.std(v_channel[valid_mask])
-        
+        # Limiares adaptativos baseados na distribuição de cores: as
+        # médias/desvios já foram calculados no escopo externo
+
         # Critérios mais sensíveis para HSV
         hsv_disease = (
             ((h_channel < (h_mean - 0.8 * h_std)) |  # Tons diferentes do verde (mais sensível)
@@ -125,20 +166,9 @@ def extract_disease_features(image, mask, image_path=None):
         
         hsv_mask[valid_mask] = hsv_disease[valid_mask]
         
-        # 2. Análise LAB adaptativa
-        lab = cv2.cvtColor(cv2.cvtColor(leaf_region, cv2.COLOR_HSV2BGR), cv2.COLOR_BGR2LAB)
-        l_channel = lab[:,:,0]  # Luminosidade
-        a_channel = lab[:,:,1]  # Verde-Vermelho
-        b_channel = lab[:,:,2]  # Azul-Amarelo
-        
-        # Calcular limiares adaptativos LAB
-        l_mean = np.mean(l_channel[valid_mask])
-        l_std = np.std(l_channel[valid_mask])
-        a_mean = np.mean(a_channel[valid_mask])
-        a_std = np.std(a_channel[valid_mask])
-        b_mean = np.mean(b_channel[valid_mask])
-        b_std = np.std(b_channel[valid_mask])
-        
+        # 2. Análise LAB adaptativa: canais e limiares reutilizados do
+        # escopo externo (lab já convertido uma única vez lá)
+
         # Critérios mais sensíveis para LAB
         lab_mask = np.zeros_like(mask)
         lab_disease = (
@@ -149,14 +179,17 @@ def extract_disease_features(image, mask, image_path=None):
         
         lab_mask[valid_mask] = lab_disease[valid_mask]
         
-        # 3. Análise de textura local
-        gray = cv2.cvtColor(leaf_region, cv2.COLOR_BGR2GRAY)
+        # 3. Análise de textura local (gray reutilizado do escopo externo)
         texture_mask = np.zeros_like(mask)
         
-        # Calcular variação local usando desvio padrão
+        # Calcular variação local usando a identidade Var = E[X²] - E[X]²:
+        # dois boxFilter em float32, sem materializar o intermediário
+        # (gray - média)² de imagem inteira (e sem o underflow do uint8)
         kernel_size = 3  # Kernel menor para detectar variações menores
-        local_std = cv2.blur((gray - cv2.blur(gray, (kernel_size, kernel_size)))**2, 
-                            (kernel_size, kernel_size))
+        gray_f = gray.astype(np.float32)
+        local_mean = cv2.boxFilter(gray_f, -1, (kernel_size, kernel_size))
+        local_sq_mean = cv2.boxFilter(gray_f * gray_f, -1, (kernel_size, kernel_size))
+        local_std = local_sq_mean - local_mean * local_mean
         
         # Limiar de textura mais sensível
         texture_thresh = np.percentile(local_std[valid_mask], 65)  # Percentil mais baixo
@@ -177,81 +210,101 @@ def extract_disease_features(image, mask, image_path=None):
         # Uma região é considerada doente se tiver peso total >= 1.8 (mais sensível)
         combined_mask = (weighted_sum >= 1.8).astype(np.uint8) * 255
         
-        # 5. Pós-processamento mais sensível
-        kernel_small = np.ones((3,3), np.uint8)
-        kernel_medium = np.ones((5,5), np.uint8)
-        
+        # 5. Pós-processamento mais sensível (kernels do nível do módulo)
         # Primeiro dilatar um pouco para conectar regiões próximas
-        disease_mask = cv2.dilate(combined_mask, kernel_small, iterations=1)
+        disease_mask = cv2.dilate(combined_mask, _KERNEL3, iterations=1)
         # Depois remover ruídos pequenos
-        disease_mask = cv2.morphologyEx(disease_mask, cv2.MORPH_OPEN, kernel_small)
-        disease_mask = cv2.morphologyEx(disease_mask, cv2.MORPH_CLOSE, kernel_medium)
-        
-        # 6. Análise de contornos com critérios mais sensíveis
-        contours, _ = cv2.findContours(disease_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Criar máscara final
-        final_mask = np.zeros_like(mask)
-        
+        disease_mask = cv2.morphologyEx(disease_mask, cv2.MORPH_OPEN, _KERNEL3)
+        disease_mask = cv2.morphologyEx(disease_mask, cv2.MORPH_CLOSE, _KERNEL5)
+        
+        # 6. Análise de componentes conexos em lote: as estatísticas de
+        # intensidade e textura de todas as regiões saem de np.bincount
+        # sobre o mapa de rótulos, sem desenhar uma máscara de imagem
+        # inteira por contorno
+        num_labels, labels, comp_stats, _ = cv2.connectedComponentsWithStats(disease_mask)
+
+        if num_labels <= 1:
+            return np.zeros_like(mask)
+
+        flat_labels = labels.ravel()
+        counts = np.bincount(flat_labels, minlength=num_labels).astype(np.float64)
+        counts[counts == 0] = 1.0
+        comp_mean = np.bincount(
+            flat_labels, weights=gray.ravel().astype(np.float64),
+            minlength=num_labels) / counts
+        comp_texture = np.bincount(
+            flat_labels, weights=local_std.astype(np.float64).ravel(),
+            minlength=num_labels) / counts
+
+        # Limiar de intensidade calculado uma vez para todas as regiões
+        gray_vals = gray[valid_mask]
+        intensity_thresh = gray_vals.mean() - 0.6 * gray_vals.std()
+
         # Parâmetros mais sensíveis para filtragem de contornos
         leaf_area = np.sum(mask) / 255.0
         min_area = max(5, leaf_area * 0.0005)  # 0.05% da folha (mais sensível)
         max_area = leaf_area * 0.40  # 40% da folha
-        
-        valid_contours = 0
+
+        # Contornos só para a geometria (área/perímetro); cada contorno é
+        # associado ao seu componente pelo rótulo do primeiro pixel
+        contours, _ = cv2.findContours(disease_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        keep_labels = []
         for contour in contours:
             area = cv2.contourArea(contour)
-            if min_area < area < max_area:
-                # Criar ROI para o contorno
-                mask_roi = np.zeros_like(mask)
-                cv2.drawContours(mask_roi, [contour], -1, 255, -1)
-                
-                # Calcular características da região
-                roi_pixels = cv2.bitwise_and(gray, gray, mask=mask_roi)
-                roi_valid = roi_pixels[mask_roi > 0]
-                
-                if len(roi_valid) > 0:
-                    # Calcular estatísticas da região
-                    roi_mean = np.mean(roi_valid)
-                    roi_std = np.std(roi_valid)
-                    
-                    # Critérios mais sensíveis para validação
-                    intensity_valid = roi_mean < (np.mean(gray[valid_mask]) - 0.6 * np.std(gray[valid_mask]))
-                    texture_valid = np.mean(local_std[mask_roi > 0]) > texture_thresh * 0.7
-                    
-                    # Verificar forma do contorno
-                    perimeter = cv2.arcLength(contour, True)
-                    circularity = 4 * np.pi * area / (perimeter * perimeter)
-                    
-                    # Critérios mais flexíveis para aceitação
-                    if (intensity_valid or texture_valid) and 0.15 < circularity < 0.98:
-                        cv2.drawContours(final_mask, [contour], -1, 255, -1)
-                        valid_contours += 1
-        
+            if not (min_area < area < max_area):
+                continue
+
+            x, y = contour[0][0]
+            label = labels[y, x]
+
+            # Critérios mais sensíveis para validação
+            intensity_valid = comp_mean[label] < intensity_thresh
+            texture_valid = comp_texture[label] > texture_thresh * 0.7
+
+            # Verificar forma do contorno
+            perimeter = cv2.arcLength(contour, True)
+            circularity = 4 * np.pi * area / (perimeter * perimeter)
+
+            # Critérios mais flexíveis para aceitação
+            if (intensity_valid or texture_valid) and 0.15 < circularity < 0.98:
+                keep_labels.append(label)
+
         # Validação final mais sensível
-        if valid_contours > 0:
-            return final_mask
-        else:
-            return np.zeros_like(mask)
+        if keep_labels:
+            return np.isin(labels, keep_labels).astype(np.uint8) * 255
+        return np.zeros_like(mask)
     
     disease_mask = detect_disease_regions()
     
     # Calcular GLCM apenas para regiões doentes
     def calculate_glcm_features(img, disease_regions, distances=[1, 2], angles=[0, np.pi/4, np.pi/2, 3*np.pi/4]):
         height, width = img.shape
-        glcm = np.zeros((256, 256))
-        
-        # Usar apenas pixels dentro das regiões doentes
+
+        # Quantizar para 32 níveis (5 bits): a co-ocorrência cai de
+        # 256x256 para 32x32 células, com impacto desprezível nas
+        # características de doença
+        img = img >> 3
+        glcm = np.zeros((32, 32))
+        
+        # Usar apenas pixels dentro das regiões doentes: cada offset vira
+        # um par de fatias deslocadas; os pares (a,b) válidos são
+        # codificados em a*256+b e acumulados com um único np.bincount
         for distance in distances:
             for angle in angles:
                 dx = int(round(distance * np.cos(angle)))
                 dy = int(round(distance * np.sin(angle)))
-                
-                for i in range(max(0, -dx), min(height, height - dx)):
-                    for j in range(max(0, -dy), min(width, width - dy)):
-                        # Verificar se ambos os pixels estão em regiões doentes
-                        if disease_regions[i,j] and disease_regions[i+dx,j+dy]:
-                            glcm[img[i,j], img[i+dx,j+dy]] += 1
+
+                i0, i1 = max(0, -dx), min(height, height - dx)
+                j0, j1 = max(0, -dy), min(width, width - dy)
+                a = img[i0:i1, j0:j1]
+                b = img[i0 + dx:i1 + dx, j0 + dy:j1 + dy]
+                both = ((disease_regions[i0:i1, j0:j1] > 0) &
+                        (disease_regions[i0 + dx:i1 + dx, j0 + dy:j1 + dy] > 0))
+                if not both.any():
+                    continue
+
+                codes = (a[both].astype(np.uint32) << 5) | b[both]
+                glcm += np.bincount(codes, minlength=1024).reshape(32, 32)
         
         # Se não houver pixels doentes, retornar zeros
         if glcm.sum() == 0:
@@ -260,9 +313,8 @@ def extract_disease_features(image, mask, image_path=None):
         # Normalizar GLCM
         glcm = glcm / glcm.sum()
         
-        # Calcular características do GLCM
-        indices = np.arange(256)
-        i_indices, j_indices = np.meshgrid(indices, indices, indexing='ij')
+        # Calcular características do GLCM (índices pré-computados no módulo)
+        i_indices, j_indices = _GLCM_I, _GLCM_J
         
         # Médias e variâncias
         mean_i = np.sum(i_indices * glcm)
@@ -303,52 +355,44 @@ def extract_disease_features(image, mask, image_path=None):
     
     # Calcular LBP apenas para regiões doentes
     def calculate_lbp(img, disease_regions):
-        lbp = np.zeros_like(img)
-        
         # Se não houver regiões doentes, retornar características zero
         if np.sum(disease_regions) == 0:
             return [0, 0, 0, 0]
-        
-        # Calcular LBP apenas para pixels em regiões doentes
-        for i in range(1, img.shape[0]-1):
-            for j in range(1, img.shape[1]-1):
-                if disease_regions[i,j]:
-                    center = img[i,j]
-                    code = 0
-                    code |= (img[i-1,j-1] >= center) << 7
-                    code |= (img[i-1,j] >= center) << 6
-                    code |= (img[i-1,j+1] >= center) << 5
-                    code |= (img[i,j+1] >= center) << 4
-                    code |= (img[i+1,j+1] >= center) << 3
-                    code |= (img[i+1,j] >= center) << 2
-                    code |= (img[i+1,j-1] >= center) << 1
-                    code |= (img[i,j-1] >= center)
-                    lbp[i,j] = code
-        
-        # Calcular histograma apenas para regiões doentes
-        hist = cv2.calcHist([lbp], [0], disease_regions, [256], [0,256])
-        hist = hist.flatten() / np.sum(hist) if np.sum(hist) > 0 else hist.flatten()
-        
+
+        # Oito comparações vetorizadas com os vizinhos deslocados,
+        # empacotadas por bit em uint8 — sem o loop Python por pixel
+        center = img[1:-1, 1:-1]
+        height, width = center.shape
+        lbp = np.zeros_like(center, dtype=np.uint8)
+        offsets = [(-1, -1, 7), (-1, 0, 6), (-1, 1, 5), (0, 1, 4),
+                   (1, 1, 3), (1, 0, 2), (1, -1, 1), (0, -1, 0)]
+        for di, dj, bit in offsets:
+            neighbor = img[1 + di:1 + di + height, 1 + dj:1 + dj + width]
+            lbp |= (neighbor >= center).astype(np.uint8) << np.uint8(bit)
+
+        # Histograma apenas das regiões doentes, via bincount (mais rápido
+        # que cv2.calcHist para um canal de 8 bits)
+        codes = lbp[disease_regions[1:-1, 1:-1] > 0]
+        if codes.size == 0:
+            return [0, 0, 0, 0]
+        hist = np.bincount(codes.ravel(), minlength=256).astype(np.float64)
+        hist = hist / hist.sum()
+
         # Extrair características do LBP
         lbp_mean = np.mean(hist)
         lbp_std = np.std(hist)
         lbp_energy = np.sum(np.square(hist))
         lbp_entropy = -np.sum(hist * np.log2(hist + 1e-10))
-        
+
         return [lbp_mean, lbp_std, lbp_energy, lbp_entropy]
     
     # Calcular características de textura apenas para regiões doentes
     glcm_features = calculate_glcm_features(gray, disease_mask)
-    features.extend(glcm_features)
-    feature_names.extend([
-        'GLCM_Contraste', 'GLCM_Correlacao', 'GLCM_Energia', 'GLCM_Homogeneidade',
-        'GLCM_Dissimilaridade', 'GLCM_Entropia', 'GLCM_Cluster_Shade', 'GLCM_Cluster_Prominence'
-    ])
-    
+    features[108:116] = glcm_features
+
     lbp_features = calculate_lbp(gray, disease_mask)
-    features.extend(lbp_features)
-    feature_names.extend(['LBP_Media', 'LBP_Desvio', 'LBP_Energia', 'LBP_Entropia'])
-    
+    features[116:120] = lbp_features
+
     # 3. Características de forma e região melhoradas
     # Encontrar contornos das regiões doentes
     contours, _ = cv2.findContours(disease_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -358,33 +402,39 @@ def extract_disease_features(image, mask, image_path=None):
     valid_contours = [cnt for cnt in contours if cv2.contourArea(cnt) > min_area]
     
     if valid_contours:
-        # Calcular características das regiões doentes
-        areas = [cv2.contourArea(cnt) for cnt in valid_contours]
-        perimeters = [cv2.arcLength(cnt, True) for cnt in valid_contours]
+        # Calcular características das regiões doentes: uma única passada
+        # pelos contornos preenche arrays paralelos (área, perímetro e
+        # centróide via momentos) em vez de três list comprehensions
+        num_lesions = len(valid_contours)
+        areas = np.empty(num_lesions, dtype=np.float64)
+        perimeters = np.empty(num_lesions, dtype=np.float64)
+        centroids = np.empty((num_lesions, 2), dtype=np.float64)
+        for k, cnt in enumerate(valid_contours):
+            areas[k] = cv2.contourArea(cnt)
+            perimeters[k] = cv2.arcLength(cnt, True)
+            moments = cv2.moments(cnt)
+            centroids[k] = (moments['m10'] / moments['m00'],
+                            moments['m01'] / moments['m00'])
         total_leaf_area = np.sum(mask) / 255.0
-        
+
         # Características de forma e distribuição
-        total_disease_area = sum(areas)
+        total_disease_area = areas.sum()
         disease_coverage = total_disease_area / total_leaf_area
-        avg_lesion_size = np.mean(areas)
-        lesion_size_std = np.std(areas) if len(areas) > 1 else 0
-        num_lesions = len(valid_contours)
+        avg_lesion_size = areas.mean()
+        lesion_size_std = areas.std() if num_lesions > 1 else 0
         lesion_density = num_lesions / total_leaf_area * 1000
-        
+
         # Calcular compacidade e elongação das lesões
-        compactness = [4 * np.pi * area / (p * p) for area, p in zip(areas, perimeters)]
-        avg_compactness = np.mean(compactness)
-        
-        # Calcular distribuição espacial das lesões
-        centroids = [np.mean(cnt.reshape(-1,2), axis=0) for cnt in valid_contours]
+        compactness = 4 * np.pi * areas / (perimeters * perimeters)
+        avg_compactness = compactness.mean()
+
+        # Calcular distribuição espacial das lesões: todas as distâncias
+        # entre pares de centróides saem de uma chamada de pdist em vez do
+        # loop duplo Python com um np.linalg.norm por par
         if len(centroids) > 1:
-            centroid_distances = []
-            for i in range(len(centroids)):
-                for j in range(i+1, len(centroids)):
-                    dist = np.linalg.norm(centroids[i] - centroids[j])
-                    centroid_distances.append(dist)
-            avg_distance = np.mean(centroid_distances)
-            std_distance = np.std(centroid_distances)
+            centroid_distances = pdist(centroids)
+            avg_distance = centroid_distances.mean()
+            std_distance = centroid_distances.std()
         else:
             avg_distance = 0
             std_distance = 0
@@ -402,126 +452,106 @@ def extract_disease_features(image, mask, image_path=None):
     else:
         shape_features = [0, 0, 0, 0, 0, 0, 0, 0]
     
-    features.extend(shape_features)
-    feature_names.extend([
-        'Num_Lesoes', 'Tamanho_Medio', 'Desvio_Tamanho', 
-        'Area_Afetada', 'Densidade_Lesoes', 'Circularidade',
-        'Dist_Media_Lesoes', 'Desvio_Dist_Lesoes'
-    ])
-    
-    return np.array(features, dtype=np.float32), feature_names
+    features[120:128] = shape_features
+
+    return features, _FEATURE_NAMES
+
+_VIS_CELL = 300  # lado de cada célula do mosaico 3x3 de visualização
+
+def _vis_panel(title):
+    """Célula branca do mosaico com o título desenhado no topo"""
+    panel = np.full((_VIS_CELL, _VIS_CELL, 3), 255, np.uint8)
+    cv2.putText(panel, title, (8, 20), cv2.FONT_HERSHEY_SIMPLEX,
+                0.45, (0, 0, 0), 1, cv2.LINE_AA)
+    return panel
+
+def _vis_image_panel(title, img):
+    """Célula com uma imagem redimensionada (BGR ou tons de cinza)"""
+    panel = _vis_panel(title)
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    body = cv2.resize(img, (_VIS_CELL - 20, _VIS_CELL - 40))
+    panel[30:30 + body.shape[0], 10:10 + body.shape[1]] = body
+    return panel
+
+def _vis_curves_panel(title, series):
+    """Célula com curvas via cv2.polylines; series = [(valores, cor, nome)]"""
+    panel = _vis_panel(title)
+    top, bottom, left, right = 40, _VIS_CELL - 30, 10, _VIS_CELL - 10
+    peak = max((float(np.max(vals)) for vals, _, _ in series), default=0) or 1.0
+    for idx, (vals, color, name) in enumerate(series):
+        xs = np.linspace(left, right, len(vals)).astype(np.int32)
+        ys = (bottom - np.asarray(vals, dtype=np.float64) / peak
+              * (bottom - top)).astype(np.int32)
+        cv2.polylines(panel, [np.column_stack([xs, ys])], False, color, 1, cv2.LINE_AA)
+        cv2.putText(panel, name, (left + idx * 40, _VIS_CELL - 8),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1, cv2.LINE_AA)
+    return panel
+
+def _vis_bars_panel(title, values, labels):
+    """Célula com barras verticais desenhadas via cv2.rectangle"""
+    panel = _vis_panel(title)
+    top, baseline, left, right = 40, _VIS_CELL - 50, 10, _VIS_CELL - 10
+    values = [float(v) for v in values]
+    peak = max((abs(v) for v in values), default=0) or 1.0
+    slot = (right - left) // len(values)
+    for idx, (value, label) in enumerate(zip(values, labels)):
+        x0 = left + idx * slot + 3
+        x1 = x0 + slot - 6
+        bar = int(abs(value) / peak * (baseline - top))
+        cv2.rectangle(panel, (x0, baseline - bar), (x1, baseline), (180, 90, 30), -1)
+        cv2.putText(panel, f"{value:.2g}", (x0, baseline - bar - 4),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.3, (0, 0, 0), 1, cv2.LINE_AA)
+        # rótulos alternam entre duas linhas para não se sobreporem
+        cv2.putText(panel, label, (x0, baseline + 14 + (idx % 2) * 12),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.3, (0, 0, 0), 1, cv2.LINE_AA)
+    return panel
 
 def visualize_features(image_path, features_dict):
-    """Visualiza as características extraídas da imagem"""
-    plt.figure(figsize=(15, 12))
-    
-    # 1. Imagem original
-    plt.subplot(331)
-    img = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
-    plt.imshow(img)
-    plt.title('Imagem Original')
-    plt.axis('off')
-    
-    # 2. Máscara da folha
-    plt.subplot(332)
-    plt.imshow(features_dict['mask'], cmap='gray')
-    plt.title('Máscara da Folha')
-    plt.axis('off')
-    
-    # 3. Região processada
-    plt.subplot(333)
-    processed = cv2.cvtColor(features_dict['processed_image'], cv2.COLOR_BGR2RGB)
-    plt.imshow(processed)
-    plt.title('Região Processada')
-    plt.axis('off')
-    
-    # 4. Histogramas HSV
-    plt.subplot(334)
-    h_values = features_dict['features'][:32]
-    s_values = features_dict['features'][32:64]
-    v_values = features_dict['features'][64:96]
-    
-    plt.plot(h_values, 'r-', label='Matiz (H)')
-    plt.plot(s_values, 'g-', label='Saturação (S)')
-    plt.plot(v_values, 'b-', label='Valor (V)')
-    plt.title('Histogramas HSV')
-    plt.legend()
-    
-    # 5. Estatísticas HSV
-    plt.subplot(335)
-    hsv_stats = features_dict['features'][96:108]  # 12 valores (4 para cada canal)
-    stat_names = ['Média', 'Desvio', 'Q25', 'Q75']
-    x = np.arange(len(stat_names))
-    width = 0.25
-    
-    plt.bar(x - width, hsv_stats[0:4], width, label='H', color='r', alpha=0.7)
-    plt.bar(x, hsv_stats[4:8], width, label='S', color='g', alpha=0.7)
-    plt.bar(x + width, hsv_stats[8:12], width, label='V', color='b', alpha=0.7)
-    plt.title('Estatísticas HSV')
-    plt.xticks(x, stat_names, rotation=45)
-    plt.legend()
-    
-    # 6. Características de Textura (GLCM - Parte 1)
-    plt.subplot(336)
-    glcm_features1 = features_dict['features'][108:112]  # Primeiros 4 valores GLCM
-    plt.bar(['Contraste', 'Correlação', 'Energia', 'Homog.'], glcm_features1)
-    plt.title('GLCM (Parte 1)')
-    plt.xticks(rotation=45)
-    
-    # 6b. Características de Textura (GLCM - Parte 2)
-    plt.subplot(337)
-    glcm_features2 = features_dict['features'][112:116]  # Últimos 4 valores GLCM
-    labels_glcm2 = ['Dissimil.', 'Entropia', 'Clust.Shade', 'Clust.Prom.']
-    plt.bar(labels_glcm2, glcm_features2)
-    plt.title('GLCM - Métricas de Textura (Parte 2)')
-    plt.xlabel('Métricas')
-    plt.ylabel('Valor Normalizado')
-    plt.xticks(rotation=45)
-    plt.ylim(0, max(glcm_features2) * 1.1 if max(glcm_features2) > 0 else 1)
-    
-    # 7. Características LBP
-    plt.subplot(338)
-    lbp_features = features_dict['features'][116:120]  # 4 valores LBP
-    plt.bar(['Média', 'Desvio', 'Energia', 'Entropia'], lbp_features)
-    plt.title('Características LBP')
-    plt.xticks(rotation=45)
-    
-    # 8. Características de Forma
-    plt.subplot(339)
-    shape_features = features_dict['features'][-8:]  # 8 valores de forma
+    """Visualiza as características extraídas da imagem.
 
-    # Escalar apenas a área afetada para porcentagem
-    scaled_shape_features = list(shape_features)
-    scaled_shape_features[3] = scaled_shape_features[3] * 100  # Área afetada em porcentagem
-
-    labels = [
-        'Nº Lesões',
-        'Tamanho Médio (px)',
-        'Desvio Tamanho (px)',
-        'Área Afetada (%)',
-        'Densidade Lesões',
-        'Circularidade',
-        'Distância Média (px)',
-        'Desvio Distância (px)'
+    O mosaico 3x3 é montado direto com OpenCV (rectangle/putText/
+    polylines + imwrite), sem pagar a renderização de uma figura
+    matplotlib por imagem analisada.
+    """
+    features = features_dict['features']
+
+    # Primeira linha: imagem original, máscara e região processada
+    img = cv2.imread(image_path)
+    panels = [
+        _vis_image_panel('Imagem Original', img),
+        _vis_image_panel('Mascara da Folha', features_dict['mask']),
+        _vis_image_panel('Regiao Processada', features_dict['processed_image']),
+        _vis_curves_panel('Histogramas HSV', [
+            (features[:32], (0, 0, 255), 'H'),
+            (features[32:64], (0, 160, 0), 'S'),
+            (features[64:96], (255, 0, 0), 'V'),
+        ]),
+        _vis_bars_panel('Estatisticas HSV', features[96:108],
+                        ['Hm', 'Hd', 'Hq1', 'Hq3', 'Sm', 'Sd', 'Sq1', 'Sq3',
+                         'Vm', 'Vd', 'Vq1', 'Vq3']),
+        _vis_bars_panel('GLCM (Parte 1)', features[108:112],
+                        ['Contr', 'Corr', 'Energ', 'Homog']),
+        _vis_bars_panel('GLCM (Parte 2)', features[112:116],
+                        ['Dissim', 'Entrop', 'Shade', 'Prom']),
+        _vis_bars_panel('LBP', features[116:120],
+                        ['Media', 'Desvio', 'Energ', 'Entrop']),
     ]
 
-    plt.bar(range(len(scaled_shape_features)), scaled_shape_features)
-    plt.xticks(range(len(scaled_shape_features)), labels, rotation=45, ha='right')
-    plt.title('Características de Forma e Distribuição')
-    plt.xlabel('Métricas')
-    plt.ylabel('Valor')
+    # Escalar apenas a área afetada para porcentagem
+    shape_features = [float(v) for v in features[-8:]]
+    shape_features[3] = shape_features[3] * 100
+    panels.append(_vis_bars_panel('Forma e Distribuicao', shape_features,
+                                  ['NLes', 'TamMed', 'DesvTam', 'Area%',
+                                   'Dens', 'Circ', 'DistMed', 'DesvDist']))
 
-    # Adicionar anotação para o número de lesões
-    plt.text(0, scaled_shape_features[0], f'{scaled_shape_features[0]:.0f}', ha='right', va='bottom')
+    canvas = np.vstack([np.hstack(panels[i:i + 3]) for i in range(0, 9, 3)])
 
-    plt.tight_layout()
-    
     # Salvar a visualização
     base_path = os.path.splitext(image_path)[0]  # Remove qualquer extensão
     output_path = f"{base_path}_analysis.jpg"
-    plt.savefig(output_path)
-    plt.close()
-    
+    cv2.imwrite(output_path, canvas)
+
     return output_path
 
 def preprocess_image(image):
@@ -535,11 +565,177 @@ def preprocess_image(image):
     
     return processed
 
-def process_image(image_path, save_to_db=False, visualize=False, metadata=None):
-    """Processa uma imagem e extrai suas características"""
+def process_image_features_only(image_path):
+    """Extrai apenas as características de uma imagem, sem tocar no banco.
+
+    Função de nível de módulo para poder ser distribuída entre processos
+    durante o processamento do dataset (workers precisam de funções picláveis).
+    """
+    try:
+        image, _ = _load_image(image_path)
+        if image is None:
+            return {"error": f"Não foi possível carregar a imagem: {image_path}"}
+
+        features, _ = extract_disease_features(image, segment_leaf(image), image_path)
+        return {"features": features.tolist()}
+    except Exception as e:
+        return {"error": str(e)}
+
+def _features_for_path(image_path):
+    """Par (caminho, resultado) para manter a associação no imap_unordered"""
+    return image_path, process_image_features_only(image_path)
+
+def process_images(image_paths, save_to_db=True):
+    """Processa um lote de imagens em paralelo com multiprocessing.Pool.
+
+    A extração (CPU-bound, código nativo do OpenCV/NumPy) é distribuída
+    entre processos e o banco recebe uma única inserção em lote ao final,
+    evitando contenção de escrita por worker.
+    """
+    features_by_path = {}
+    errors = {}
+    try:
+        with multiprocessing.Pool(os.cpu_count()) as pool:
+            for image_path, result in pool.imap_unordered(
+                    _features_for_path, image_paths, chunksize=4):
+                if "error" in result:
+                    errors[image_path] = result["error"]
+                    print(f"Erro ao processar {image_path}: {result['error']}")
+                else:
+                    features_by_path[image_path] = result["features"]
+
+        if save_to_db and features_by_path:
+            paths = list(features_by_path)
+            chroma.add_embeddings_batch(
+                [str(hash(path)) for path in paths],
+                [features_by_path[path] for path in paths],
+                [{
+                    "path": path,
+                    "type": "leaf_disease",
+                    "processing_date": str(datetime.now())
+                } for path in paths])
+
+        return {"features": features_by_path, "errors": errors}
+    except Exception as e:
+        print(f"Erro ao processar lote de imagens: {str(e)}")
+        return {"features": features_by_path, "errors": errors}
+
+def extract_features_from_array(image):
+    """Extrai características de uma imagem já decodificada em memória.
+
+    Permite que a decodificação (I/O + libjpeg) aconteça em outra thread
+    enquanto a extração consome quadros já prontos.
+    """
+    try:
+        if image is None:
+            return {"error": "Imagem inválida (decodificação falhou)"}
+
+        features, _ = extract_disease_features(image, segment_leaf(image))
+        return {"features": features.tolist()}
+    except Exception as e:
+        return {"error": str(e)}
+
+def _load_image(image_path):
+    """Lê os bytes do arquivo uma única vez e decodifica com cv2.imdecode.
+
+    Os bytes retornados podem ser reaproveitados para o hash de conteúdo
+    do cache de embeddings sem uma segunda leitura do disco.
+    """
+    with open(image_path, 'rb') as handle:
+        buf = handle.read()
+    image = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return image, buf
+
+def prefetch_images(image_paths, maxsize=4):
+    """Gerador que produz pares (caminho, imagem) com leitura antecipada.
+
+    Uma thread leitora decodifica as próximas imagens em uma fila limitada
+    (a decodificação do OpenCV libera o GIL), escondendo a latência de
+    disco atrás da extração da imagem anterior; imagens que falham na
+    leitura saem como None.
+    """
+    prefetched = queue.Queue(maxsize=maxsize)
+    sentinel = object()
+
+    def reader():
+        for path in image_paths:
+            try:
+                image, _ = _load_image(path)
+            except Exception:
+                image = None
+            prefetched.put((path, image))
+        prefetched.put(sentinel)
+
+    threading.Thread(target=reader, daemon=True).start()
+    while True:
+        item = prefetched.get()
+        if item is sentinel:
+            break
+        yield item
+
+# Fila de inserções pendentes no banco: process_image acumula os embeddings
+# e uma thread de escrita os envia em lotes, tirando a chamada ao Chroma do
+# caminho crítico da extração. Quem ingere vários arquivos deve chamar
+# flush_pending() ao final para garantir que o restante foi gravado.
+_PENDING_FLUSH_SIZE = 64
+_pending = []
+_pending_lock = threading.Lock()
+_flush_executor = ThreadPoolExecutor(max_workers=1)
+_flush_future = None
+
+def _flush_batch(batch):
+    """Insere um lote acumulado de embeddings no banco"""
+    ok = chroma.add_embeddings_batch(
+        [item[0] for item in batch],
+        [item[1] for item in batch],
+        [item[2] for item in batch])
+    if not ok:
+        print(f"Erro ao gravar lote de {len(batch)} embeddings no banco")
+    return ok
+
+def _maybe_flush():
+    """Agenda a escrita em segundo plano quando a fila atinge o tamanho de lote"""
+    global _flush_future
+    with _pending_lock:
+        if len(_pending) < _PENDING_FLUSH_SIZE:
+            return
+        batch = _pending[:]
+        _pending.clear()
+    _flush_future = _flush_executor.submit(_flush_batch, batch)
+
+def flush_pending():
+    """Grava no banco o que restou na fila de inserções pendentes.
+
+    Espera também qualquer escrita em segundo plano ainda em andamento;
+    retorna False se alguma inserção falhou.
+    """
+    global _flush_future
+    ok = True
+    if _flush_future is not None:
+        ok = bool(_flush_future.result())
+        _flush_future = None
+    with _pending_lock:
+        batch = _pending[:]
+        _pending.clear()
+    if batch:
+        ok = bool(_flush_batch(batch)) and ok
+    return ok
+
+# Garante que lotes menores que o tamanho de flush não se percam quando o
+# processo termina sem chamar flush_pending() explicitamente
+atexit.register(flush_pending)
+
+def process_image(image_path, save_to_db=False, visualize=False, metadata=None, image=None):
+    """Processa uma imagem e extrai suas características.
+
+    Aceita opcionalmente a imagem já decodificada (ex.: vinda de
+    prefetch_images) para não reler o arquivo.
+    """
     try:
-        # Carregar imagem
-        image = cv2.imread(image_path)
+        # Carregar imagem (bytes lidos uma vez, decodificados em memória)
+        buf = None
+        if image is None:
+            image, buf = _load_image(image_path)
         if image is None:
             return {"error": f"Não foi possível carregar a imagem: {image_path}"}
         
@@ -572,10 +768,12 @@ def process_image(image_path, save_to_db=False, visualize=False, metadata=None):
             
             # Gerar ID único baseado no caminho da imagem
             image_id = str(hash(image_path))
-            
-            # Adicionar ao banco de dados
-            if not chroma.add_embedding(image_id, features.tolist(), metadata):
-                return {"error": "Erro ao salvar no banco de dados"}
+
+            # Enfileirar para escrita em lote (sai do caminho crítico;
+            # flush_pending() garante a gravação ao final da ingestão)
+            with _pending_lock:
+                _pending.append((image_id, features.tolist(), metadata))
+            _maybe_flush()
         
         return {
             "features": features.tolist(),
@@ -583,7 +781,10 @@ def process_image(image_path, save_to_db=False, visualize=False, metadata=None):
             "processed_image": processed_image,
             "mask": segment_leaf(image),
             "original_image": image,
-            "visualization_path": visualization_path
+            "visualization_path": visualization_path,
+            # hash dos mesmos bytes já lidos, para o cache de embeddings
+            # (None quando a imagem veio decodificada de fora)
+            "content_sha256": hashlib.sha256(buf).hexdigest() if buf is not None else None
         }
         
     except Exception as e:
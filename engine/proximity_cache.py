@@ -0,0 +1,81 @@
+"""
+Cache de proximidade para consultas de similaridade.
+
+Consultas quase idênticas (mesma folha reprocessada, loops interativos da
+demo) são respondidas a partir do cache quando a distância de cosseno para
+a chave mais próxima fica abaixo de uma tolerância, evitando repetir a
+busca no banco vetorial. A métrica é a mesma de cosseno usada pelo Chroma.
+"""
+
+import numpy as np
+from collections import OrderedDict
+
+class ProximityCache:
+    """Cache limitado de resultados de consulta indexado por embedding"""
+
+    def __init__(self, max_size=512, tolerance=0.05):
+        self.max_size = max_size
+        self.tolerance = tolerance
+        # OrderedDict preserva a ordem de uso para a expulsão LRU;
+        # as chaves normalizadas ficam empilhadas em matriz para o
+        # produto escalar em uma única operação vetorizada
+        self._entries = OrderedDict()
+        self._keys_matrix = None
+        # ids na mesma ordem das linhas da matriz: o move_to_end do LRU
+        # reordena _entries, então o mapeamento linha→entrada precisa ser
+        # congelado junto com a matriz
+        self._cache_ids = []
+
+    def _rebuild_matrix(self):
+        if self._entries:
+            self._cache_ids = list(self._entries.keys())
+            self._keys_matrix = np.vstack([e[0] for e in self._entries.values()])
+        else:
+            self._cache_ids = []
+            self._keys_matrix = None
+
+    def _normalize(self, embedding):
+        vec = np.asarray(embedding, dtype=np.float64)
+        norm = np.sqrt(vec @ vec)
+        return vec / norm if norm > 0 else vec
+
+    def lookup(self, embedding):
+        """Retorna o valor da chave mais próxima, ou None se nenhuma
+        estiver dentro da tolerância de cosseno"""
+        if self._keys_matrix is None:
+            return None
+        query = self._normalize(embedding)
+        sims = self._keys_matrix @ query
+        best = int(np.argmax(sims))
+        if sims[best] >= 1.0 - self.tolerance:
+            cache_id = self._cache_ids[best]
+            self._entries.move_to_end(cache_id)
+            return self._entries[cache_id][1]
+        return None
+
+    def insert(self, embedding, value):
+        """Guarda o resultado para o embedding, expulsando o menos usado"""
+        query = self._normalize(embedding)
+        self._entries[id(value)] = (query, value)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._rebuild_matrix()
+
+    def query(self, embedding, fallback, **kwargs):
+        """Consulta o cache; em caso de falta delega para fallback e guarda"""
+        cached = self.lookup(embedding)
+        if cached is not None:
+            return cached
+        result = fallback(embedding, **kwargs)
+        # chroma.query_embedding devolve (None, False) em caso de falha —
+        # uma tupla verdadeira; não guardar para não repetir o erro em
+        # todas as consultas próximas
+        if result and result[0] is not None:
+            self.insert(embedding, result)
+        return result
+
+    def clear(self):
+        """Esvazia o cache (usar após alterações no banco)"""
+        self._entries.clear()
+        self._cache_ids = []
+        self._keys_matrix = None
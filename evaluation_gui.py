@@ -5,7 +5,7 @@ import os
 from pathlib import Path
 from evaluation_system import CBIREvaluationSystem
 from database import chroma
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
 
@@ -160,10 +160,47 @@ class EvaluationGUI(tk.Tk):
         ttk.Label(confidence_frame, text="Score de Risco:").grid(row=1, column=0, sticky=tk.W, padx=(0, 10))
         ttk.Label(confidence_frame, textvariable=self.risk_score_var, font=('Arial', 10, 'bold')).grid(row=1, column=1, sticky=tk.W)
         
-        # Área para gráficos
+        # Área para gráficos. A figura, os eixos e o canvas Tk são criados
+        # uma única vez aqui; _generate_plots só atualiza os artistas e
+        # agenda o redesenho, em vez de reconstruir tudo a cada avaliação
         self.metrics_canvas_frame = ttk.Frame(metrics_frame)
         self.metrics_canvas_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
-        
+
+        # Figure direto (sem pyplot): evita o registro global de figuras do
+        # _pylab_helpers, que seguraria referências e callbacks do Tk; o
+        # layout 'tight' fica a cargo do layout engine configurado na criação
+        self.metrics_fig = Figure(figsize=(12, 8), layout='tight')
+        axes = self.metrics_fig.subplots(2, 2)
+        self.metrics_fig.suptitle('Métricas de Avaliação CBIR', fontsize=14, fontweight='bold')
+        (self.ax_general, self.ax_confidence), (self.ax_confusion, self.ax_risk) = axes
+
+        # 1. Métricas gerais: as barras e seus rótulos são persistentes
+        metrics_names = ['Acurácia', 'Precisão', 'Recall', 'F1-Score']
+        self.metric_bars = self.ax_general.bar(
+            metrics_names, [0, 0, 0, 0],
+            color=['#2E86AB', '#A23B72', '#F18F01', '#C73E1D'])
+        self.metric_bar_labels = [
+            self.ax_general.text(bar.get_x() + bar.get_width() / 2, 0.01, '',
+                                 ha='center', va='bottom')
+            for bar in self.metric_bars]
+        self.ax_general.set_title('Métricas Gerais')
+        self.ax_general.set_ylabel('Score')
+        self.ax_general.set_ylim(0, 1)
+
+        self.ax_confidence.set_title('Distribuição por Confiança')
+        self.ax_confusion.set_title('Matriz de Confusão')
+
+        # 4. Score de risco: barra única persistente
+        self.risk_bar = self.ax_risk.bar(['Risco Médio'], [0], color='#fd7e14')[0]
+        self.risk_bar_label = self.ax_risk.text(0, 0.01, '', ha='center', va='bottom')
+        self.ax_risk.set_title('Score Médio de Risco')
+        self.ax_risk.set_ylabel('Score')
+        self.ax_risk.set_ylim(0, 1)
+
+        self.metrics_canvas = FigureCanvasTkAgg(self.metrics_fig, self.metrics_canvas_frame)
+        self.metrics_canvas.draw()
+        self.metrics_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+
     def create_revocation_tab(self):
         """Cria a aba de análise de revogação"""
         revocation_frame = ttk.Frame(self.notebook)
@@ -205,18 +242,25 @@ class EvaluationGUI(tk.Tk):
         """Atualiza estatísticas do banco de dados"""
         try:
             stats = chroma.get_database_stats()
-            
-            self.stats_text.delete(1.0, tk.END)
-            self.stats_text.insert(tk.END, f"Total de imagens: {stats['total_images']}\n")
-            self.stats_text.insert(tk.END, f"Última atualização: {stats.get('last_update', 'N/A')}\n\n")
-            
+
+            # Montar o texto completo em memória e escrever no widget de uma
+            # só vez: cada insert cruza a fronteira Python↔Tcl e reprocessa
+            # o layout do Text incrementalmente
+            lines = [
+                f"Total de imagens: {stats['total_images']}\n",
+                f"Última atualização: {stats.get('last_update', 'N/A')}\n\n"
+            ]
+
             if stats['categories']:
-                self.stats_text.insert(tk.END, "Categorias:\n")
+                lines.append("Categorias:\n")
                 for cat, count in stats['categories'].items():
-                    self.stats_text.insert(tk.END, f"• {cat}: {count} imagens\n")
+                    lines.append(f"• {cat}: {count} imagens\n")
             else:
-                self.stats_text.insert(tk.END, "Nenhuma categoria encontrada\n")
-                
+                lines.append("Nenhuma categoria encontrada\n")
+
+            self.stats_text.delete(1.0, tk.END)
+            self.stats_text.insert(tk.END, "".join(lines))
+
         except Exception as e:
             self.stats_text.delete(1.0, tk.END)
             self.stats_text.insert(tk.END, f"Erro ao carregar estatísticas: {str(e)}")
@@ -280,31 +324,35 @@ class EvaluationGUI(tk.Tk):
         self.std_confidence_var.set(f"{metrics['std_confidence']:.1f}%")
         self.risk_score_var.set(f"{metrics['avg_risk_score']:.3f}")
         
-        # Atualizar resultados detalhados
-        self.results_text.delete(1.0, tk.END)
-        self.results_text.insert(tk.END, "=== RESULTADOS DA AVALIAÇÃO ===\n\n")
-        
-        self.results_text.insert(tk.END, f"📊 MÉTRICAS GERAIS:\n")
-        self.results_text.insert(tk.END, f"• Acurácia geral: {metrics['overall_accuracy']:.3f}\n")
-        self.results_text.insert(tk.END, f"• Precisão: {metrics['precision']:.3f}\n")
-        self.results_text.insert(tk.END, f"• Recall: {metrics['recall']:.3f}\n")
-        self.results_text.insert(tk.END, f"• F1-Score: {metrics['f1_score']:.3f}\n\n")
-        
-        self.results_text.insert(tk.END, f"📈 ANÁLISE DE CONFIANÇA:\n")
-        self.results_text.insert(tk.END, f"• Confiança média: {metrics['avg_confidence']:.1f}%\n")
-        self.results_text.insert(tk.END, f"• Desvio padrão da confiança: {metrics['std_confidence']:.1f}%\n")
-        self.results_text.insert(tk.END, f"• Score médio de risco: {metrics['avg_risk_score']:.3f}\n\n")
-        
+        # Atualizar resultados detalhados: o texto inteiro é montado em uma
+        # lista e escrito no widget com um único delete + insert, em vez de
+        # dezenas de inserts (cada um é uma ida ao interpretador Tcl)
+        results_lines = [
+            "=== RESULTADOS DA AVALIAÇÃO ===\n\n",
+            f"📊 MÉTRICAS GERAIS:\n",
+            f"• Acurácia geral: {metrics['overall_accuracy']:.3f}\n",
+            f"• Precisão: {metrics['precision']:.3f}\n",
+            f"• Recall: {metrics['recall']:.3f}\n",
+            f"• F1-Score: {metrics['f1_score']:.3f}\n\n",
+            f"📈 ANÁLISE DE CONFIANÇA:\n",
+            f"• Confiança média: {metrics['avg_confidence']:.1f}%\n",
+            f"• Desvio padrão da confiança: {metrics['std_confidence']:.1f}%\n",
+            f"• Score médio de risco: {metrics['avg_risk_score']:.3f}\n\n"
+        ]
+
         # Análise de revogação
         revocation_analysis = self.evaluator.analyze_revocation_patterns(test_results)
-        
-        self.results_text.insert(tk.END, f"⚠️ ANÁLISE DE RISCO DE REVOGAÇÃO:\n")
+
+        results_lines.append(f"⚠️ ANÁLISE DE RISCO DE REVOGAÇÃO:\n")
         for risk_level, analysis in revocation_analysis.items():
-            self.results_text.insert(tk.END, f"• Risco {risk_level}:\n")
-            self.results_text.insert(tk.END, f"  - Quantidade: {analysis['count']} imagens\n")
-            self.results_text.insert(tk.END, f"  - Acurácia: {analysis['accuracy']:.3f}\n")
-            self.results_text.insert(tk.END, f"  - Confiança média: {analysis['avg_confidence']:.1f}%\n")
-            self.results_text.insert(tk.END, f"  - Score de risco médio: {analysis['avg_risk_score']:.3f}\n\n")
+            results_lines.append(f"• Risco {risk_level}:\n")
+            results_lines.append(f"  - Quantidade: {analysis['count']} imagens\n")
+            results_lines.append(f"  - Acurácia: {analysis['accuracy']:.3f}\n")
+            results_lines.append(f"  - Confiança média: {analysis['avg_confidence']:.1f}%\n")
+            results_lines.append(f"  - Score de risco médio: {analysis['avg_risk_score']:.3f}\n\n")
+
+        self.results_text.delete(1.0, tk.END)
+        self.results_text.insert(tk.END, "".join(results_lines))
         
         # Atualizar treeview de risco
         self.risk_tree.delete(*self.risk_tree.get_children())
@@ -317,70 +365,59 @@ class EvaluationGUI(tk.Tk):
                 f"{analysis['avg_risk_score']:.3f}"
             ))
         
-        # Atualizar análise de revogação
-        self.revocation_text.delete(1.0, tk.END)
-        self.revocation_text.insert(tk.END, "=== ANÁLISE DETALHADA DE REVOGAÇÃO ===\n\n")
-        
+        # Atualizar análise de revogação (mesma técnica: uma única escrita)
+        revocation_lines = ["=== ANÁLISE DETALHADA DE REVOGAÇÃO ===\n\n"]
+
         for risk_level, analysis in revocation_analysis.items():
-            self.revocation_text.insert(tk.END, f"RISCO {risk_level}:\n")
-            self.revocation_text.insert(tk.END, f"• Total de imagens: {analysis['count']}\n")
-            self.revocation_text.insert(tk.END, f"• Predições corretas: {analysis['correct_predictions']}\n")
-            self.revocation_text.insert(tk.END, f"• Predições incorretas: {analysis['incorrect_predictions']}\n")
-            self.revocation_text.insert(tk.END, f"• Acurácia: {analysis['accuracy']:.3f}\n")
-            self.revocation_text.insert(tk.END, f"• Confiança média: {analysis['avg_confidence']:.1f}%\n")
-            self.revocation_text.insert(tk.END, f"• Score de risco médio: {analysis['avg_risk_score']:.3f}\n\n")
-            
+            revocation_lines.append(f"RISCO {risk_level}:\n")
+            revocation_lines.append(f"• Total de imagens: {analysis['count']}\n")
+            revocation_lines.append(f"• Predições corretas: {analysis['correct_predictions']}\n")
+            revocation_lines.append(f"• Predições incorretas: {analysis['incorrect_predictions']}\n")
+            revocation_lines.append(f"• Acurácia: {analysis['accuracy']:.3f}\n")
+            revocation_lines.append(f"• Confiança média: {analysis['avg_confidence']:.1f}%\n")
+            revocation_lines.append(f"• Score de risco médio: {analysis['avg_risk_score']:.3f}\n\n")
+
             # Recomendações baseadas no nível de risco
             if risk_level == "ALTO":
-                self.revocation_text.insert(tk.END, "RECOMENDAÇÕES PARA RISCO ALTO:\n")
-                self.revocation_text.insert(tk.END, "• Revisar qualidade das imagens de treinamento\n")
-                self.revocation_text.insert(tk.END, "• Considerar adicionar mais exemplos da categoria\n")
-                self.revocation_text.insert(tk.END, "• Verificar se há inconsistências no dataset\n")
-                self.revocation_text.insert(tk.END, "• Implementar validação cruzada\n\n")
+                revocation_lines.append("RECOMENDAÇÕES PARA RISCO ALTO:\n")
+                revocation_lines.append("• Revisar qualidade das imagens de treinamento\n")
+                revocation_lines.append("• Considerar adicionar mais exemplos da categoria\n")
+                revocation_lines.append("• Verificar se há inconsistências no dataset\n")
+                revocation_lines.append("• Implementar validação cruzada\n\n")
             elif risk_level == "MÉDIO":
-                self.revocation_text.insert(tk.END, "RECOMENDAÇÕES PARA RISCO MÉDIO:\n")
-                self.revocation_text.insert(tk.END, "• Melhorar qualidade das imagens\n")
-                self.revocation_text.insert(tk.END, "• Aumentar diversidade do dataset\n")
-                self.revocation_text.insert(tk.END, "• Considerar técnicas de data augmentation\n\n")
+                revocation_lines.append("RECOMENDAÇÕES PARA RISCO MÉDIO:\n")
+                revocation_lines.append("• Melhorar qualidade das imagens\n")
+                revocation_lines.append("• Aumentar diversidade do dataset\n")
+                revocation_lines.append("• Considerar técnicas de data augmentation\n\n")
             else:
-                self.revocation_text.insert(tk.END, "O sistema está funcionando bem para este nível de risco.\n\n")
+                revocation_lines.append("O sistema está funcionando bem para este nível de risco.\n\n")
+
+        self.revocation_text.delete(1.0, tk.END)
+        self.revocation_text.insert(tk.END, "".join(revocation_lines))
         
         # Gerar gráficos se solicitado
         if self.generate_report_var.get():
             self._generate_plots(metrics)
             
     def _generate_plots(self, metrics):
-        """Gera gráficos das métricas"""
+        """Atualiza os gráficos das métricas"""
         try:
-            # Limpar frame anterior
-            for widget in self.metrics_canvas_frame.winfo_children():
-                widget.destroy()
-            
-            # Criar figura
-            fig, axes = plt.subplots(2, 2, figsize=(12, 8))
-            fig.suptitle('Métricas de Avaliação CBIR', fontsize=14, fontweight='bold')
-            
-            # 1. Métricas gerais
-            ax1 = axes[0, 0]
-            metrics_names = ['Acurácia', 'Precisão', 'Recall', 'F1-Score']
+            # 1. Métricas gerais: só as alturas e os rótulos das barras mudam
             metrics_values = [
                 metrics['overall_accuracy'],
                 metrics['precision'],
                 metrics['recall'],
                 metrics['f1_score']
             ]
-            
-            bars = ax1.bar(metrics_names, metrics_values, color=['#2E86AB', '#A23B72', '#F18F01', '#C73E1D'])
-            ax1.set_title('Métricas Gerais')
-            ax1.set_ylabel('Score')
-            ax1.set_ylim(0, 1)
-            
-            for bar, value in zip(bars, metrics_values):
-                ax1.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.01,
-                        f'{value:.3f}', ha='center', va='bottom')
-            
-            # 2. Distribuição de confiança
-            ax2 = axes[0, 1]
+
+            for bar, label, value in zip(self.metric_bars, self.metric_bar_labels, metrics_values):
+                bar.set_height(value)
+                label.set_position((bar.get_x() + bar.get_width() / 2, value + 0.01))
+                label.set_text(f'{value:.3f}')
+
+            # 2. Distribuição de confiança (pizza não tem atualização
+            # in-place: limpar apenas este eixo e redesenhar)
+            self.ax_confidence.clear()
             conf_analysis = metrics['confidence_analysis']
             conf_levels = ['Alta (≥80%)', 'Média (60-80%)', 'Baixa (<60%)']
             conf_counts = [
@@ -388,40 +425,35 @@ class EvaluationGUI(tk.Tk):
                 conf_analysis['medium_confidence']['count'],
                 conf_analysis['low_confidence']['count']
             ]
-            
+
             colors = ['#28a745', '#ffc107', '#dc3545']
-            ax2.pie(conf_counts, labels=conf_levels, autopct='%1.1f%%', colors=colors)
-            ax2.set_title('Distribuição por Confiança')
-            
-            # 3. Matriz de confusão
-            ax3 = axes[1, 0]
+            self.ax_confidence.pie(conf_counts, labels=conf_levels, autopct='%1.1f%%', colors=colors)
+            self.ax_confidence.set_title('Distribuição por Confiança')
+
+            # 3. Matriz de confusão: o número de classes pode mudar entre
+            # avaliações, então este eixo também é redesenhado do zero
+            self.ax_confusion.clear()
             cm = np.array(metrics['confusion_matrix'])
-            im = ax3.imshow(cm, cmap='Blues', aspect='auto')
-            ax3.set_title('Matriz de Confusão')
-            ax3.set_xlabel('Predito')
-            ax3.set_ylabel('Real')
-            
+            self.ax_confusion.imshow(cm, cmap='Blues', aspect='auto')
+            self.ax_confusion.set_title('Matriz de Confusão')
+            self.ax_confusion.set_xlabel('Predito')
+            self.ax_confusion.set_ylabel('Real')
+
             # Adicionar valores na matriz
             for i in range(cm.shape[0]):
                 for j in range(cm.shape[1]):
-                    ax3.text(j, i, str(cm[i, j]), ha='center', va='center')
-            
+                    self.ax_confusion.text(j, i, str(cm[i, j]), ha='center', va='center')
+
             # 4. Score de risco
-            ax4 = axes[1, 1]
             risk_score = metrics['avg_risk_score']
-            ax4.bar(['Risco Médio'], [risk_score], color='#fd7e14')
-            ax4.set_title('Score Médio de Risco')
-            ax4.set_ylabel('Score')
-            ax4.set_ylim(0, 1)
-            ax4.text(0, risk_score + 0.01, f'{risk_score:.3f}', ha='center', va='bottom')
-            
-            plt.tight_layout()
-            
-            # Criar canvas
-            canvas = FigureCanvasTkAgg(fig, self.metrics_canvas_frame)
-            canvas.draw()
-            canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-            
+            self.risk_bar.set_height(risk_score)
+            self.risk_bar_label.set_position((0, risk_score + 0.01))
+            self.risk_bar_label.set_text(f'{risk_score:.3f}')
+
+            # draw_idle agenda um único repaint coalescido pelo Tk, em vez
+            # de forçar a rasterização síncrona da figura inteira
+            self.metrics_canvas.draw_idle()
+
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao gerar gráficos: {str(e)}")
             
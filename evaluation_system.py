@@ -6,20 +6,42 @@ from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
 import seaborn as sns
+from collections import Counter
 from datetime import datetime
 import json
 import os
 from pathlib import Path
 from database import chroma
 from engine import processing_engine as engine
+from engine import embedding_cache
 import warnings
 warnings.filterwarnings('ignore')
 
+# Barra de progresso opcional; sem tqdm instalado os prints por imagem
+# continuam sendo o indicador de progresso
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
 class CBIREvaluationSystem:
     """
     Sistema de avaliação e previsão de revogação para CBIR
     """
     
+    # Tabela de fatores de risco: característica avaliada e descrição,
+    # com limiar, direção (abaixo/acima) e peso nos arrays paralelos
+    _RISK_RULES = (
+        ("confidence", "Confiança muito baixa"),
+        ("std_similarity", "Alta variabilidade nas similaridades"),
+        ("category_consistency", "Baixa consistência de categoria"),
+        ("similarity_gap", "Grande diferença entre imagens similares"),
+        ("shape_variability", "Alta variabilidade nas características de forma"),
+    )
+    _RISK_THRESHOLDS = np.array([60, 15, 0.6, 20, 0.5])
+    _RISK_BELOW = np.array([True, False, True, False, False])
+    _RISK_WEIGHTS = np.array([0.4, 0.3, 0.3, 0.2, 0.2])
+
     def __init__(self):
         self.revocation_model = None
         self.confidence_threshold = 0.7
@@ -40,25 +62,22 @@ class CBIREvaluationSystem:
         if len(similar_images) < 3:
             return None
             
-        # Características baseadas na distribuição de similaridade
-        similarities = [img["similarity"] for img in similar_images]
-        max_sim = max(similarities)
-        min_sim = min(similarities)
-        mean_sim = np.mean(similarities)
-        std_sim = np.std(similarities)
-        
+        # Características baseadas na distribuição de similaridade: um
+        # único array e reduções vetorizadas em vez de max/min/listas Python
+        similarities = np.asarray(
+            [img["similarity"] for img in similar_images], dtype=np.float32)
+        max_sim = similarities.max().item()
+        min_sim = similarities.min().item()
+        mean_sim = similarities.mean().item()
+        std_sim = similarities.std().item()
+
         # Características baseadas na consistência de categoria
         categories = [img["category"] for img in similar_images]
-        category_counts = {}
-        for cat in categories:
-            category_counts[cat] = category_counts.get(cat, 0) + 1
-        
-        dominant_category = max(category_counts.items(), key=lambda x: x[1])
-        category_consistency = dominant_category[1] / len(categories)
-        
+        dominant_count = max(Counter(categories).values())
+        category_consistency = dominant_count / len(categories)
+
         # Características baseadas nas diferenças entre imagens similares
-        top_3_similarities = similarities[:3]
-        similarity_gap = max_sim - min(top_3_similarities)
+        similarity_gap = max_sim - similarities[:3].min().item()
         
         # Características de forma das imagens similares
         shape_features = []
@@ -72,7 +91,9 @@ class CBIREvaluationSystem:
             ])
         
         # Calcular variabilidade das características de forma
-        shape_variability = np.std(shape_features) if shape_features else 0
+        shape_variability = (
+            np.std(np.asarray(shape_features, dtype=np.float32)).item()
+            if shape_features else 0)
         
         return {
             "confidence": confidence,
@@ -98,35 +119,18 @@ class CBIREvaluationSystem:
                 "reason": "Dados insuficientes para análise"
             }
         
-        # Análise baseada em regras
-        risk_factors = []
-        risk_score = 0
-        
-        # Fator 1: Confiança baixa
-        if features["confidence"] < 60:
-            risk_factors.append("Confiança muito baixa")
-            risk_score += 0.4
-        
-        # Fator 2: Alta variabilidade de similaridade
-        if features["std_similarity"] > 15:
-            risk_factors.append("Alta variabilidade nas similaridades")
-            risk_score += 0.3
-        
-        # Fator 3: Baixa consistência de categoria
-        if features["category_consistency"] < 0.6:
-            risk_factors.append("Baixa consistência de categoria")
-            risk_score += 0.3
-        
-        # Fator 4: Gap muito grande entre similaridades
-        if features["similarity_gap"] > 20:
-            risk_factors.append("Grande diferença entre imagens similares")
-            risk_score += 0.2
-        
-        # Fator 5: Alta variabilidade nas características de forma
-        if features["shape_variability"] > 0.5:
-            risk_factors.append("Alta variabilidade nas características de forma")
-            risk_score += 0.2
-        
+        # Análise baseada em regras: todos os fatores são comparados de uma
+        # vez contra a tabela de limiares, sem a cascata de ifs por consulta
+        values = np.fromiter(
+            (features[key] for key, _ in self._RISK_RULES), dtype=np.float64)
+        triggered = np.where(
+            self._RISK_BELOW,
+            values < self._RISK_THRESHOLDS,
+            values > self._RISK_THRESHOLDS)
+        risk_score = float(self._RISK_WEIGHTS[triggered].sum())
+        risk_factors = [
+            label for (_, label), hit in zip(self._RISK_RULES, triggered) if hit]
+
         # Determinar nível de risco
         if risk_score >= 0.8:
             risk_level = "ALTO"
@@ -143,7 +147,86 @@ class CBIREvaluationSystem:
             "features": features
         }
     
-    def evaluate_system_performance(self, test_dataset_path, ground_truth_file=None):
+    def _collect_test_features(self, test_dataset, workers=1):
+        """Lista as imagens de teste e extrai (ou reaproveita) seus embeddings.
+
+        Retorna uma lista de tuplas (img_path, category_name, features,
+        query_metadata) na ordem do dataset. A extração das imagens sem
+        cache roda em paralelo quando workers > 1.
+        """
+        # Processar cada categoria usando os.scandir: DirEntry mantém em
+        # cache name/is_dir e evita alocar um Path por arquivo do dataset
+        with os.scandir(test_dataset) as it:
+            category_dirs = [e for e in it if e.is_dir(follow_symlinks=False)]
+
+        # Fase 1: listar as imagens de teste em uma única passada e separar
+        # as que já têm embedding no cache das que precisam de extração
+        test_entries = []  # (img_path, category_name)
+        cached_features = {}  # str(img_path) -> features
+        to_extract = []
+        for category_dir in category_dirs:
+            category_name = category_dir.name
+            print(f"\nProcessando categoria: {category_name}")
+
+            with os.scandir(category_dir.path) as it:
+                image_entries = [
+                    e for e in it
+                    if e.is_file() and e.name.lower().endswith(('.jpg', '.jpeg', '.png'))
+                ]
+
+            for entry in image_entries:
+                test_entries.append((Path(entry.path), category_name))
+                try:
+                    features = embedding_cache.get(embedding_cache.content_key(entry.path))
+                except Exception as e:
+                    print(f"Erro ao ler {entry.name}: {str(e)}")
+                    continue
+                if features is not None:
+                    cached_features[entry.path] = features
+                else:
+                    to_extract.append(entry.path)
+
+        # Extração das imagens sem cache — em paralelo quando workers > 1,
+        # já que OpenCV/NumPy liberam o GIL e a função é picklável
+        if to_extract:
+            if workers and workers > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    extracted = executor.map(
+                        engine.process_image_features_only, to_extract, chunksize=4)
+                    extracted = list(extracted)
+            else:
+                progress = tqdm(to_extract, unit='img') if tqdm is not None else to_extract
+                extracted = [engine.process_image_features_only(p) for p in progress]
+
+            new_cache_entries = []
+            for img_path, result in zip(to_extract, extracted):
+                if "error" in result:
+                    print(f"Erro ao processar {os.path.basename(img_path)}: {result['error']}")
+                    continue
+                cached_features[img_path] = result["features"]
+                new_cache_entries.append(
+                    (embedding_cache.content_key(img_path), result["features"]))
+
+            # Persistir o cache uma única vez para o lote inteiro; set() por
+            # imagem regravaria o pickle completo a cada extração
+            if new_cache_entries:
+                embedding_cache.set_many(new_cache_entries)
+
+        pending = []  # (img_path, category_name, features, query_metadata)
+        for img_path, category_name in test_entries:
+            features = cached_features.get(str(img_path))
+            if features is None:
+                continue
+            pending.append((img_path, category_name, features, {
+                "path": str(img_path),
+                "type": "test_image",
+                "processing_date": str(datetime.now()),
+                "category": "test"
+            }))
+        return pending
+
+    def evaluate_system_performance(self, test_dataset_path, ground_truth_file=None, workers=1):
         """
         Avalia a performance do sistema CBIR
         """
@@ -165,61 +248,46 @@ class CBIREvaluationSystem:
         
         print(f"\nProcessando dataset de teste: {test_dataset_path}")
         
-        # Processar cada categoria
-        for category_dir in test_dataset.iterdir():
-            if not category_dir.is_dir():
-                continue
-                
-            category_name = category_dir.name
-            print(f"\nProcessando categoria: {category_name}")
-            
-            for img_path in category_dir.glob('*'):
-                if img_path.suffix.lower() in ['.jpg', '.jpeg', '.png']:
-                    try:
-                        # Processar imagem
-                        result = engine.process_image(str(img_path), save_to_db=False, visualize=False)
-                        
-                        if "error" in result:
-                            print(f"Erro ao processar {img_path.name}: {result['error']}")
-                            continue
-                        
-                        # Consultar banco de dados
-                        query_metadata = {
-                            "path": str(img_path),
-                            "type": "test_image",
-                            "processing_date": str(datetime.now()),
-                            "category": "test"
-                        }
-                        
-                        query_results = chroma.query_embedding(result["features"], metadata=query_metadata)
-                        
-                        if not query_results:
-                            continue
-                        
-                        # Analisar resultados
-                        analysis = chroma.analyze_query_results(query_results)
-                        
-                        if analysis:
-                            # Prever risco de revogação
-                            revocation_prediction = self.predict_revocation_risk(analysis)
-                            
-                            test_results.append({
-                                "image_path": str(img_path),
-                                "true_category": category_name,
-                                "predicted_category": analysis.get("identified_category", "unknown"),
-                                "confidence": analysis.get("confidence", 0),
-                                "revocation_risk": revocation_prediction["revocation_risk"],
-                                "risk_score": revocation_prediction["risk_score"],
-                                "analysis": analysis,
-                                "revocation_prediction": revocation_prediction
-                            })
-                            
-                            print(f"  {img_path.name}: {analysis.get('identified_category', 'unknown')} "
-                                  f"(conf: {analysis.get('confidence', 0):.1f}%, "
-                                  f"risco: {revocation_prediction['revocation_risk']})")
-                    
-                    except Exception as e:
-                        print(f"Erro ao processar {img_path.name}: {str(e)}")
+        pending = self._collect_test_features(test_dataset, workers)
+
+        # Fase 2: consultar o banco em lotes — uma chamada ao chroma por
+        # grupo de imagens em vez de uma chamada por imagem
+        batch_size = 32
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batched_results = chroma.query_embeddings_batch(
+                [features for _, _, features, _ in chunk],
+                metadatas=[metadata for _, _, _, metadata in chunk])
+
+            for (img_path, category_name, _, _), query_results in zip(chunk, batched_results):
+                try:
+                    if not query_results or query_results[0] is None:
+                        continue
+
+                    # Analisar resultados
+                    analysis = chroma.analyze_query_results(query_results)
+
+                    if analysis:
+                        # Prever risco de revogação
+                        revocation_prediction = self.predict_revocation_risk(analysis)
+
+                        test_results.append({
+                            "image_path": str(img_path),
+                            "true_category": category_name,
+                            "predicted_category": analysis.get("identified_category", "unknown"),
+                            "confidence": analysis.get("confidence", 0),
+                            "revocation_risk": revocation_prediction["revocation_risk"],
+                            "risk_score": revocation_prediction["risk_score"],
+                            "analysis": analysis,
+                            "revocation_prediction": revocation_prediction
+                        })
+
+                        print(f"  {img_path.name}: {analysis.get('identified_category', 'unknown')} "
+                              f"(conf: {analysis.get('confidence', 0):.1f}%, "
+                              f"risco: {revocation_prediction['revocation_risk']})")
+
+                except Exception as e:
+                    print(f"Erro ao processar {img_path.name}: {str(e)}")
         
         # Calcular métricas
         if not test_results:
@@ -235,7 +303,102 @@ class CBIREvaluationSystem:
             "test_results": test_results,
             "metrics": metrics
         }
-    
+
+    def evaluate_system_performance_batched(self, test_dataset_path, workers=1, n_results=5):
+        """
+        Avalia todo o dataset de teste com uma única multiplicação de matrizes.
+
+        Os embeddings de teste (Q) e do banco (E) são empilhados em
+        matrizes float32 com linhas normalizadas; todas as similaridades
+        de cosseno saem de um único Q @ E.T (GEMM do BLAS) seguido de
+        np.argpartition por linha, em vez de uma consulta por imagem.
+        """
+        print("=== AVALIAÇÃO DO SISTEMA CBIR (LOTE) ===")
+
+        test_dataset = Path(test_dataset_path)
+        if not test_dataset.exists():
+            print(f"Erro: Dataset de teste não encontrado em {test_dataset_path}")
+            return None
+
+        print(f"\nProcessando dataset de teste: {test_dataset_path}")
+        pending = self._collect_test_features(test_dataset, workers)
+        if not pending:
+            print("Nenhuma imagem de teste processada!")
+            return None
+
+        # Matriz do banco, sem as imagens de análise geradas pelas consultas
+        ids, embeddings, metadatas = chroma.get_all_embeddings()
+        keep = [i for i, meta in enumerate(metadatas)
+                if not meta or meta.get('type') != 'leaf_disease_analysis']
+        if not keep:
+            print("Nenhuma imagem no banco de dados!")
+            return None
+        E = np.asarray(embeddings, dtype=np.float32)[keep]
+        E /= np.linalg.norm(E, axis=1, keepdims=True) + 1e-12
+        db_categories = [(metadatas[i] or {}).get('category', 'unknown') for i in keep]
+
+        Q = np.asarray([features for _, _, features, _ in pending], dtype=np.float32)
+        Q /= np.linalg.norm(Q, axis=1, keepdims=True) + 1e-12
+
+        # Todas as similaridades de uma vez e top-k ordenado por linha
+        sims = Q @ E.T
+        k = min(n_results, E.shape[0])
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(pending))[:, None]
+        top = top[rows, np.argsort(-sims[rows, top], axis=1)]
+
+        test_results = []
+        for row, (img_path, category_name, _, _) in enumerate(pending):
+            try:
+                neighbor_sims = 100 * sims[row, top[row]]
+                neighbor_cats = [db_categories[j] for j in top[row]]
+
+                # Categoria por maioria entre os vizinhos; confiança é a
+                # similaridade média dos vizinhos da categoria vencedora
+                identified = Counter(neighbor_cats).most_common(1)[0][0]
+                winner_sims = [float(s) for s, c in zip(neighbor_sims, neighbor_cats)
+                               if c == identified]
+                analysis = {
+                    "identified_category": identified,
+                    "confidence": float(np.mean(winner_sims)),
+                    "similar_images": [
+                        {"similarity": float(s), "category": c}
+                        for s, c in zip(neighbor_sims, neighbor_cats)
+                    ]
+                }
+
+                revocation_prediction = self.predict_revocation_risk(analysis)
+
+                test_results.append({
+                    "image_path": str(img_path),
+                    "true_category": category_name,
+                    "predicted_category": identified,
+                    "confidence": analysis["confidence"],
+                    "revocation_risk": revocation_prediction["revocation_risk"],
+                    "risk_score": revocation_prediction["risk_score"],
+                    "analysis": analysis,
+                    "revocation_prediction": revocation_prediction
+                })
+
+                print(f"  {img_path.name}: {identified} "
+                      f"(conf: {analysis['confidence']:.1f}%, "
+                      f"risco: {revocation_prediction['revocation_risk']})")
+
+            except Exception as e:
+                print(f"Erro ao processar {img_path.name}: {str(e)}")
+
+        if not test_results:
+            print("Nenhum resultado de teste obtido!")
+            return None
+
+        metrics = self.calculate_performance_metrics(test_results)
+        self.save_evaluation_results(test_results, metrics)
+
+        return {
+            "test_results": test_results,
+            "metrics": metrics
+        }
+
     def calculate_performance_metrics(self, test_results):
         """
         Calcula métricas de performance
@@ -243,32 +406,28 @@ class CBIREvaluationSystem:
         if not test_results:
             return {}
         
-        # Preparar dados para métricas
+        # Preparar dados em layout SoA: arrays paralelos preenchidos em uma
+        # passada, para as agregações virarem reduções vetorizadas
+        n = len(test_results)
         y_true = []
         y_pred = []
-        confidences = []
-        risk_scores = []
-        
-        for result in test_results:
+        confidences = np.empty(n, dtype=np.float32)
+        risk_scores = np.empty(n, dtype=np.float32)
+        correct = np.empty(n, dtype=np.bool_)
+
+        for i, result in enumerate(test_results):
             true_cat = result["true_category"]
             pred_cat = result["predicted_category"]
-            
+
             # Normalizar categorias
-            if "healthy" in true_cat.lower():
-                true_cat = "leaf_healthy"
-            else:
-                true_cat = "leaf_with_disease"
-            
-            if "healthy" in pred_cat.lower():
-                pred_cat = "leaf_healthy"
-            else:
-                pred_cat = "leaf_with_disease"
-            
-            y_true.append(true_cat)
-            y_pred.append(pred_cat)
-            confidences.append(result["confidence"])
-            risk_scores.append(result["risk_score"])
-        
+            y_true.append("leaf_healthy" if "healthy" in true_cat.lower()
+                          else "leaf_with_disease")
+            y_pred.append("leaf_healthy" if "healthy" in pred_cat.lower()
+                          else "leaf_with_disease")
+            confidences[i] = result["confidence"]
+            risk_scores[i] = result["risk_score"]
+            correct[i] = true_cat == pred_cat
+
         # Calcular métricas básicas
         accuracy = accuracy_score(y_true, y_pred)
         
@@ -282,22 +441,21 @@ class CBIREvaluationSystem:
         cm = confusion_matrix(y_true, y_pred, labels=categories)
         
         # Análise de confiança
-        avg_confidence = np.mean(confidences)
-        std_confidence = np.std(confidences)
-        
+        avg_confidence = confidences.mean().item()
+        std_confidence = confidences.std().item()
+
         # Análise de risco de revogação
-        avg_risk_score = np.mean(risk_scores)
-        
-        # Análise por nível de confiança
-        high_conf_results = [r for r in test_results if r["confidence"] >= 80]
-        medium_conf_results = [r for r in test_results if 60 <= r["confidence"] < 80]
-        low_conf_results = [r for r in test_results if r["confidence"] < 60]
-        
-        high_conf_accuracy = accuracy_score(
-            [r["true_category"] for r in high_conf_results],
-            [r["predicted_category"] for r in high_conf_results]
-        ) if high_conf_results else 0
-        
+        avg_risk_score = risk_scores.mean().item()
+
+        # Análise por nível de confiança: máscaras sobre o array em vez de
+        # três varreduras da lista de resultados
+        high_mask = confidences >= 80
+        low_mask = confidences < 60
+        medium_mask = ~high_mask & ~low_mask
+
+        high_conf_accuracy = (
+            correct[high_mask].mean().item() if high_mask.any() else 0)
+
         return {
             "overall_accuracy": accuracy,
             "precision": precision,
@@ -310,14 +468,14 @@ class CBIREvaluationSystem:
             "avg_risk_score": avg_risk_score,
             "confidence_analysis": {
                 "high_confidence": {
-                    "count": len(high_conf_results),
+                    "count": int(high_mask.sum()),
                     "accuracy": high_conf_accuracy
                 },
                 "medium_confidence": {
-                    "count": len(medium_conf_results)
+                    "count": int(medium_mask.sum())
                 },
                 "low_confidence": {
-                    "count": len(low_conf_results)
+                    "count": int(low_mask.sum())
                 }
             },
             "total_tests": len(test_results)
@@ -480,33 +638,33 @@ class CBIREvaluationSystem:
         if not test_results:
             return {}
         
-        # Agrupar por risco de revogação
-        risk_groups = {}
-        for result in test_results:
-            risk = result["revocation_risk"]
-            if risk not in risk_groups:
-                risk_groups[risk] = []
-            risk_groups[risk].append(result)
-        
-        # Analisar cada grupo
+        # Layout SoA: arrays paralelos preenchidos em uma passada; cada
+        # grupo de risco vira uma máscara com reduções vetorizadas
+        n = len(test_results)
+        risk_labels = np.array([r["revocation_risk"] for r in test_results])
+        confidences = np.fromiter(
+            (r["confidence"] for r in test_results), dtype=np.float32, count=n)
+        risk_scores = np.fromiter(
+            (r["risk_score"] for r in test_results), dtype=np.float32, count=n)
+        correct = np.fromiter(
+            (r["true_category"] == r["predicted_category"] for r in test_results),
+            dtype=np.bool_, count=n)
+
         analysis = {}
-        for risk_level, results in risk_groups.items():
-            correct_predictions = sum(1 for r in results if r["true_category"] == r["predicted_category"])
-            total = len(results)
-            accuracy = correct_predictions / total if total > 0 else 0
-            
-            avg_confidence = np.mean([r["confidence"] for r in results])
-            avg_risk_score = np.mean([r["risk_score"] for r in results])
-            
+        for risk_level in dict.fromkeys(risk_labels.tolist()):
+            mask = risk_labels == risk_level
+            total = int(mask.sum())
+            correct_predictions = int(correct[mask].sum())
+
             analysis[risk_level] = {
                 "count": total,
-                "accuracy": accuracy,
-                "avg_confidence": avg_confidence,
-                "avg_risk_score": avg_risk_score,
+                "accuracy": correct_predictions / total if total > 0 else 0,
+                "avg_confidence": confidences[mask].mean().item(),
+                "avg_risk_score": risk_scores[mask].mean().item(),
                 "correct_predictions": correct_predictions,
                 "incorrect_predictions": total - correct_predictions
             }
-        
+
         return analysis
 
 def main():